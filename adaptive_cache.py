@@ -0,0 +1,96 @@
+'''
+In-process cache of adaptive item weights, keyed by (user, list).
+
+ListHandler.GET?sort=adaptive used to re-read UserItemInfo for every item
+and recompute the weights each time a game round started. The weights only
+change when new events arrive for the user, so they are cached here and
+EventsHandler.POST drops the entries that its events touch. Only the
+weights are cached: the weighted shuffle still runs on every request.
+
+The cache lives in each server process. Events handled by another process
+do not invalidate it, so entries also expire after MAX_AGE_SECONDS.
+'''
+
+from collections import OrderedDict
+import threading
+import time
+
+MAX_ENTRIES = 10000
+MAX_AGE_SECONDS = 300
+
+
+class AdaptiveOrderCache(object):
+  '''
+  Bounded LRU map from (user id, list id) to the adaptive weights of the
+  list's items, in list order.
+  '''
+  def __init__(self, max_entries=MAX_ENTRIES, max_age=MAX_AGE_SECONDS):
+    self.max_entries = max_entries
+    self.max_age = max_age
+    self._entries = OrderedDict()
+    # user id -> set of cache keys, for invalidation.
+    self._keys_by_user = {}
+    self._lock = threading.Lock()
+    self.hits = 0
+    self.misses = 0
+
+  def get(self, user_id, list_id, item_ids):
+    '''
+    Returns the cached weights, or None if there are none or the list's
+    items have changed since they were computed.
+    '''
+    key = (str(user_id), str(list_id))
+    with self._lock:
+      entry = self._entries.get(key)
+      if (entry is None or entry['itemIds'] != tuple(item_ids) or
+          time.time() - entry['created'] > self.max_age):
+        self.misses += 1
+        return None
+      # Mark as most recently used.
+      del self._entries[key]
+      self._entries[key] = entry
+      self.hits += 1
+      return entry['weights']
+
+  def put(self, user_id, list_id, item_ids, weights):
+    key = (str(user_id), str(list_id))
+    entry = {
+      'itemIds': tuple(item_ids),
+      'itemIdSet': frozenset(item_ids),
+      'weights': list(weights),
+      'created': time.time(),
+    }
+    with self._lock:
+      self._entries.pop(key, None)
+      self._entries[key] = entry
+      self._keys_by_user.setdefault(key[0], set()).add(key)
+      while len(self._entries) > self.max_entries:
+        old_key, old_entry = self._entries.popitem(last=False)
+        self._forget_key(old_key)
+
+  def invalidate_items(self, user_id, item_ids):
+    '''
+    Drops the user's entries for lists that contain any of the items.
+    '''
+    item_ids = set(str(item_id) for item_id in item_ids)
+    with self._lock:
+      for key in list(self._keys_by_user.get(str(user_id), ())):
+        entry = self._entries.get(key)
+        if entry is None or not entry['itemIdSet'].isdisjoint(item_ids):
+          self._entries.pop(key, None)
+          self._forget_key(key)
+
+  def clear(self):
+    with self._lock:
+      self._entries.clear()
+      self._keys_by_user.clear()
+
+  def _forget_key(self, key):
+    keys = self._keys_by_user.get(key[0])
+    if keys is not None:
+      keys.discard(key)
+      if not keys:
+        del self._keys_by_user[key[0]]
+
+
+order_cache = AdaptiveOrderCache()
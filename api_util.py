@@ -11,6 +11,7 @@ ALLOWED_HEADERS = [
     'Origin', 'Content-Type', 'Accept',
     'X-OpenMinds-Access-Token',
     'X-Openminds-Depth',
+    'If-None-Match', 'If-Modified-Since',
 ]
 
 class OpenMindsAPIHandler(CrossOriginRequestHandler):
@@ -0,0 +1,86 @@
+'''
+Concurrent counterpart to the OpenMinds API clients.
+
+AsyncOpenMindsClient wraps an existing client (two- or three-legged) and
+exposes the same methods, but each call is run on a bounded pool of worker
+threads and returns an AsyncResult right away. Call get() on the result to
+wait for the decoded JSON response:
+
+  async_client = AsyncOpenMindsClient(client, concurrency=32)
+  pending = [async_client.create_item(list_id, info) for info in items]
+  responses = [p.get() for p in pending]
+
+The API calls are purely I/O bound, so threads are enough to keep many
+requests in flight. The wrapped client should have a connection pool at
+least as large as the concurrency, e.g.
+OpenMindsTwoLeggedClient(key, secret, host, pool_size=32).
+'''
+
+from multiprocessing.pool import ThreadPool
+import logging
+import threading
+
+DEFAULT_CONCURRENCY = 32
+
+
+def _run_and_release(semaphore, fn, args):
+  try:
+    return fn(*args)
+  finally:
+    semaphore.release()
+
+
+class AsyncOpenMindsClient(object):
+  '''
+  Runs the methods of the wrapped client on up to `concurrency` worker
+  threads. Any public method of the wrapped client (get_lists, create_list,
+  create_item, update_user, ...) can be called on this object.
+  '''
+  def __init__(self, client, concurrency=DEFAULT_CONCURRENCY):
+    self.client = client
+    self.concurrency = concurrency
+    pool_size = getattr(getattr(client, 'pool', None), 'maxsize', None)
+    if pool_size is not None and pool_size < concurrency:
+      logging.warning(
+          'Connection pool for %s holds %d connections; only that many of '
+          'the %d concurrent requests will be in flight.' %
+          (client.host, pool_size, concurrency))
+    self._workers = ThreadPool(concurrency)
+
+  def __getattr__(self, name):
+    if name.startswith('_'):
+      raise AttributeError(name)
+    method = getattr(self.client, name)
+    if not callable(method):
+      return method
+
+    def submit(*args):
+      return self._workers.apply_async(method, args)
+    submit.__name__ = name
+    return submit
+
+  def fan_out(self, fn, args_list, max_in_flight=None):
+    '''
+    Calls fn(*args) for every tuple in args_list with at most max_in_flight
+    calls outstanding, and returns the AsyncResults in input order. fn is
+    either a callable or the name of a client method. The semaphore keeps a
+    very long args_list from being queued up front.
+    '''
+    if not callable(fn):
+      fn = getattr(self.client, fn)
+    if max_in_flight is None:
+      max_in_flight = self.concurrency
+    semaphore = threading.BoundedSemaphore(max_in_flight)
+    results = []
+    for args in args_list:
+      semaphore.acquire()
+      results.append(self._workers.apply_async(
+          _run_and_release, (semaphore, fn, tuple(args))))
+    return results
+
+  def close(self):
+    '''
+    Waits for the outstanding calls and stops the worker threads.
+    '''
+    self._workers.close()
+    self._workers.join()
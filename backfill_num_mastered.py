@@ -0,0 +1,41 @@
+'''
+Backfills the numMastered counter that UserHandler.GET reads, along with the
+mastered flags on UserItemInfo that keep it up to date. Safe to re-run to
+repair counters that have drifted.
+
+Usage: python backfill_num_mastered.py [user_id ...]
+With no user ids, every user that has not been deleted is processed.
+'''
+
+from backend import User
+from bson.objectid import ObjectId
+import logging
+import sys
+
+import data_api
+
+
+def main(user_ids):
+  if user_ids:
+    user_ids = [ObjectId(user_id) for user_id in user_ids]
+  else:
+    user_ids = (user['_id'] for user in
+                User.collection.find({'deleted': False}, {'_id': 1}))
+
+  num_users = 0
+  for user_id in user_ids:
+    try:
+      num_mastered = data_api.repair_num_mastered(user_id)
+    except Exception, e:
+      logging.error('Could not repair numMastered for user %s: %s' %
+                    (user_id, e))
+      continue
+    logging.debug('User %s: %d mastered' % (user_id, num_mastered))
+    num_users += 1
+    if num_users % 1000 == 0:
+      print 'Repaired %d users' % num_users
+  print 'Repaired %d users' % num_users
+
+
+if __name__ == '__main__':
+  main(sys.argv[1:])
@@ -0,0 +1,92 @@
+'''
+Times data_api.adaptive_sort_item_list for 500 and 2,000 item lists.
+
+The UserItemInfo collection is replaced by an in-memory stand-in, so the
+numbers cover matching items to their stats, the mastery scores and the
+adaptive weighting, without Mongo round trips. Needs the server's backend
+and adaptive_model modules on the path.
+
+Usage: python benchmarks/adaptive_sort_bench.py [--runs=20]
+'''
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_util import parse_options, percentile
+from bson.objectid import ObjectId
+import adaptive_model
+import data_api
+
+LIST_SIZES = (500, 2000)
+DEFAULT_RUNS = 20
+
+
+class FakeUser(object):
+  def __init__(self):
+    self._id = ObjectId()
+
+
+class InMemoryCollection(object):
+  '''
+  Answers the {'userId': ..., 'itemId': {'$in': [...]}} query issued by
+  adaptive_sort_item_list.
+  '''
+  def __init__(self, documents):
+    self.documents = documents
+
+  def find(self, spec):
+    item_ids = set(spec['itemId']['$in'])
+    return [d for d in self.documents
+            if d.userId == spec['userId'] and d.itemId in item_ids]
+
+
+def make_list(user, num_items, rng):
+  '''
+  Returns the item json for a list, and stats for about 80% of its items.
+  '''
+  json_items = []
+  stats = []
+  for i in range(num_items):
+    item_id = ObjectId()
+    json_items.append({'id': str(item_id), 'word': 'word%d' % i})
+    if rng.random() < 0.8:
+      total = rng.randint(1, 30)
+      stats.append(adaptive_model.UserItemInfo({
+        'userId': user._id,
+        'itemId': item_id,
+        'totalOutcomes': total,
+        'average': rng.random(),
+        'volatility': rng.random(),
+      }))
+  return json_items, stats
+
+
+def main(runs):
+  rng = random.Random(12345)
+  user = FakeUser()
+  original_collection = adaptive_model.UserItemInfo.collection
+  try:
+    for num_items in LIST_SIZES:
+      json_items, stats = make_list(user, num_items, rng)
+      adaptive_model.UserItemInfo.collection = InMemoryCollection(stats)
+
+      timings = []
+      for run in range(runs):
+        start = time.time()
+        data_api.adaptive_sort_item_list(list(json_items), user)
+        timings.append((time.time() - start) * 1000)
+      timings.sort()
+      print '%5d items: p50 %7.2f ms  p95 %7.2f ms  max %7.2f ms' % (
+          num_items, percentile(timings, 0.5), percentile(timings, 0.95),
+          timings[-1])
+  finally:
+    adaptive_model.UserItemInfo.collection = original_collection
+
+
+if __name__ == '__main__':
+  options = parse_options({'runs': DEFAULT_RUNS}, sys.argv[1:])
+  main(options['runs'])
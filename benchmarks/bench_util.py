@@ -0,0 +1,27 @@
+'''
+Helpers shared by the benchmark scripts.
+
+percentile is the one metrics.py reports the handler latencies with, so
+the benchmarks and /metrics/ compute their percentiles the same way.
+'''
+
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from metrics import percentile
+
+
+def parse_options(defaults, argv):
+  '''
+  Returns a copy of defaults updated from the --name=value arguments of
+  argv. Values are converted to the type of their default; unknown
+  arguments are ignored.
+  '''
+  options = dict(defaults)
+  for arg in argv:
+    for name in defaults:
+      if arg.startswith('--%s=' % name):
+        options[name] = type(defaults[name])(arg[len('--%s=' % name):])
+  return options
@@ -0,0 +1,128 @@
+'''
+Compares the two ways of finding a student's assignments over a synthetic
+district: scanning Class for the student and then querying Assignment with
+$in, against looking the classes up in the class_membership index.
+
+The district is written to a scratch database (dropped afterwards): 50,000
+students, each in CLASSES_PER_STUDENT classes of CLASS_SIZE students, with
+ASSIGNMENTS_PER_CLASS assignments per class. Needs a local mongod, and the
+server's backend module on the path.
+
+Usage: python benchmarks/class_membership_bench.py [--students=50000]
+           [--lookups=200] [--mongo_host=localhost] [--db=om_membership_bench]
+'''
+
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_util import parse_options, percentile
+from bson.objectid import ObjectId
+import class_membership
+import pymongo
+
+DEFAULTS = {
+  'students': '50000',
+  'lookups': '200',
+  'mongo_host': 'localhost',
+  'db': 'om_membership_bench',
+}
+CLASS_SIZE = 25
+CLASSES_PER_STUDENT = 6
+ASSIGNMENTS_PER_CLASS = 10
+ASSIGNMENTS_PER_REQUEST = 50
+
+
+def build_district(db, num_students, rng):
+  '''
+  Writes the classes and assignments, and returns the student ids. Classes
+  are filled from shuffled student lists, one pass per class period.
+  '''
+  student_ids = [str(ObjectId()) for i in range(num_students)]
+  classes = []
+  for period in range(CLASSES_PER_STUDENT):
+    roster = list(student_ids)
+    rng.shuffle(roster)
+    for start in range(0, len(roster), CLASS_SIZE):
+      classes.append({
+        '_id': ObjectId(),
+        'students': roster[start:start + CLASS_SIZE],
+        'deleted': False,
+      })
+  for start in range(0, len(classes), 1000):
+    db.classes.insert(classes[start:start + 1000])
+
+  assignments = []
+  for class_doc in classes:
+    for i in range(ASSIGNMENTS_PER_CLASS):
+      assignments.append({
+        'classId': str(class_doc['_id']),
+        'deleted': False,
+      })
+      if len(assignments) == 1000:
+        db.assignments.insert(assignments)
+        assignments = []
+  if assignments:
+    db.assignments.insert(assignments)
+  db.assignments.ensure_index([('classId', pymongo.ASCENDING)])
+
+  class_membership.collection = db[class_membership.COLLECTION_NAME]
+  class_membership.rebuild(db.classes.find({}, {'students': 1}))
+  print '%d students, %d classes, %d assignments' % (
+      num_students, len(classes), len(classes) * ASSIGNMENTS_PER_CLASS)
+  return student_ids
+
+
+def find_assignments(db, class_ids):
+  return list(db.assignments.find(
+      {'deleted': False, 'classId': {'$in': class_ids}}).limit(
+          ASSIGNMENTS_PER_REQUEST))
+
+
+def scan_class_ids(db, student_id):
+  return [str(class_doc['_id'])
+          for class_doc in db.classes.find({'students': student_id})]
+
+
+def scan_lookup(db, student_id):
+  return find_assignments(db, scan_class_ids(db, student_id))
+
+
+def index_lookup(db, student_id):
+  return find_assignments(db, class_membership.get_class_ids(student_id))
+
+
+def time_lookups(name, lookup_fn, db, student_ids):
+  timings = []
+  for student_id in student_ids:
+    start = time.time()
+    lookup_fn(db, student_id)
+    timings.append((time.time() - start) * 1000)
+  timings.sort()
+  print '%-16s p50 %7.2f ms  p95 %7.2f ms  max %7.2f ms' % (
+      name, percentile(timings, 0.5), percentile(timings, 0.95), timings[-1])
+
+
+def main(options):
+  rng = random.Random(12345)
+  connection = pymongo.MongoClient(options['mongo_host'])
+  connection.drop_database(options['db'])
+  db = connection[options['db']]
+  try:
+    student_ids = build_district(db, int(options['students']), rng)
+    sample = [rng.choice(student_ids) for i in range(int(options['lookups']))]
+    for student_id in sample[:10]:
+      assert (sorted(scan_class_ids(db, student_id)) ==
+              sorted(class_membership.get_class_ids(student_id)))
+    time_lookups('Class scan', scan_lookup, db, sample)
+    time_lookups('Membership index', index_lookup, db, sample)
+  finally:
+    connection.drop_database(options['db'])
+
+
+if __name__ == '__main__':
+  options = parse_options(DEFAULTS, sys.argv[1:])
+  main(options)
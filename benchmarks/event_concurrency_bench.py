@@ -0,0 +1,137 @@
+'''
+Fires parallel event batches at one user through data_api.record_event_batches
+and checks that no points or item outcomes were lost.
+
+Runs against the database configured for the server's backend module, using
+a throwaway user that is removed afterwards, along with its events, item
+infos and sampling records. Reports batches and events per
+second, then compares the user's points and each item's totalOutcomes with
+the totals implied by the events sent.
+
+Usage: python benchmarks/event_concurrency_bench.py [--batches=200]
+           [--events=10] [--items=20] [--threads=16]
+'''
+
+from datetime import datetime
+from multiprocessing.pool import ThreadPool
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend import Event, User
+from bench_util import parse_options
+from bson.objectid import ObjectId
+import adaptive_model
+import data_api
+
+DEFAULTS = {
+  'batches': 200,
+  'events': 10,
+  'items': 20,
+  'threads': 16,
+}
+
+
+def make_batches(item_ids, num_batches, num_events, rng):
+  '''
+  Returns the event json of each batch, plus the points and per item
+  outcome counts the batches should add up to.
+  '''
+  batches = []
+  expected_points = 0
+  expected_outcomes = dict((item_id, 0) for item_id in item_ids)
+  for b in range(num_batches):
+    events_json = []
+    for e in range(num_events):
+      item_id = rng.choice(item_ids)
+      outcome = rng.random() < 0.7
+      events_json.append({
+        'itemId': str(item_id),
+        'timestamp': int(time.time()),
+        'outcome': outcome,
+        'duration': rng.randint(500, 5000),
+      })
+      if outcome:
+        expected_points += 10
+      expected_outcomes[item_id] += 1
+    batches.append(events_json)
+  return batches, expected_points, expected_outcomes
+
+
+def record_batch(user_id, events_json):
+  # Each submission loads its own copy of the user, as the handler does.
+  log_user = User.collection.find_one({'_id': user_id})
+  events = []
+  for event_json in events_json:
+    event_json = dict(event_json)
+    Event.validate(event_json)
+    event_json['itemId'] = ObjectId(event_json['itemId'])
+    event_json['timestamp'] = datetime.fromtimestamp(event_json['timestamp'])
+    event = Event(event_json)
+    event.set_user(log_user)
+    events.append(event)
+  data_api.record_event_batches(log_user, [{
+    'listId': None,
+    'appId': None,
+    'timestamp': int(time.time()),
+    'events': events,
+  }])
+
+
+def main(options):
+  rng = random.Random(12345)
+  user_id = ObjectId()
+  User.collection.insert({
+    '_id': user_id,
+    'username': 'event-bench-%s' % user_id,
+    'deleted': False,
+    'points': 0,
+  })
+  item_ids = [ObjectId() for i in range(options['items'])]
+  batches, expected_points, expected_outcomes = make_batches(
+      item_ids, options['batches'], options['events'], rng)
+
+  workers = ThreadPool(options['threads'])
+  try:
+    start = time.time()
+    pending = [workers.apply_async(record_batch, (user_id, events_json))
+               for events_json in batches]
+    for result in pending:
+      result.get()
+    elapsed = time.time() - start
+
+    num_events = options['batches'] * options['events']
+    print '%d batches of %d events on %d threads in %.2f s' % (
+        options['batches'], options['events'], options['threads'], elapsed)
+    print '  %.1f batches/s  %.1f events/s' % (
+        options['batches'] / elapsed, num_events / elapsed)
+
+    points = User.collection.find_one({'_id': user_id}).get('points', 0)
+    print '  points: expected %d, stored %d' % (expected_points, points)
+    for info in adaptive_model.UserItemInfo.collection.find(
+        {'userId': user_id, 'itemId': {'$in': item_ids}}):
+      expected_outcomes[info.itemId] -= info.totalOutcomes
+    mismatched = [item_id for item_id, missing in expected_outcomes.iteritems()
+                  if missing]
+    print '  items with wrong totalOutcomes: %d of %d' % (
+        len(mismatched), len(item_ids))
+    if points != expected_points or mismatched:
+      print 'FAILED'
+      return 1
+    print 'OK'
+    return 0
+  finally:
+    workers.close()
+    workers.join()
+    adaptive_model.UserItemInfo.collection.remove({'userId': user_id})
+    Event.collection.remove({'userId': user_id})
+    adaptive_model.SamplingSummary.collection.remove({'userId': user_id})
+    User.collection.remove({'_id': user_id})
+
+
+if __name__ == '__main__':
+  options = parse_options(DEFAULTS, sys.argv[1:])
+  sys.exit(main(options))
@@ -0,0 +1,358 @@
+'''
+Writes a synthetic dataset for benchmarking the data_api and stats_api
+handlers. At --scale=1 it has:
+- 100,000 users: 5,000 teachers, and students in classes of CLASS_SIZE;
+- 10,000 classes, two per teacher;
+- 50,000 lists by the teachers, each with 1 to List.max_list_size items
+  (MEAN_LIST_SIZE on average);
+- about 20,000,000 events from the students, in study sessions on one list.
+
+--scale multiplies the number of users, classes and lists, and
+--event_scale the number of events on top of it. The output depends only on
+the seed and the scale factors: document ids are derived from the kind and
+index of each document, and every list and student draws from its own
+seeded generator. The one exception is any creation time the document
+classes stamp themselves. Documents are generated lazily and written
+--batch_size at a time, so memory use does not grow with the dataset.
+
+Events are written directly to the Event collection, without the adaptive
+model. The first --replay_users students' events go through
+data_api.record_event_batches instead, one call per session, so that those
+students also have item and list infos, samplings and points for the
+stats pages. All users have the password PASSWORD, and their own API key
+and secret, drawn from their seeded generator in the format reset_oauth
+uses.
+
+--target=mongo writes through the collections of the server's backend
+module, to the database it is configured for. --target=memory writes to the
+collections of memory_backend; it is meant for small scales, and for
+benchmarks that call generate() to build their dataset in process.
+
+Usage: python benchmarks/generate_dataset.py [--target=mongo] [--scale=1]
+           [--event_scale=1] [--seed=12345] [--batch_size=1000]
+           [--replay_users=100]
+'''
+
+from array import array
+from bson.objectid import ObjectId
+from datetime import datetime, timedelta
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bench_util import parse_options
+
+DEFAULTS = {
+  'target': 'mongo',
+  'scale': '1',
+  'event_scale': '1',
+  'seed': '12345',
+  'batch_size': '1000',
+  'replay_users': '100',
+}
+NUM_USERS = 100000
+NUM_CLASSES = 10000
+NUM_LISTS = 50000
+NUM_EVENTS = 20000000
+CLASSES_PER_TEACHER = 2
+CLASS_SIZE = 25
+MEAN_LIST_SIZE = 40
+SESSION_SIZES = (5, 30)
+CORRECT_RATE = 0.7
+PASSWORD = 'password'
+GRADES = ['3', '4', '5', '6', '7', '8']
+# Events are spread over the half year after START_DATE.
+START_DATE = datetime(2014, 1, 6)
+STUDY_DAYS = 180
+
+# Document id prefixes, one per kind of document.
+USER, CLASS, LIST, ITEM, EVENT = range(1, 6)
+
+
+def document_id(kind, index, sub_index=0):
+  return ObjectId('%08x%08x%08x' % (kind, index, sub_index))
+
+
+def make_rng(seed, kind, index):
+  return random.Random((seed << 40) ^ (kind << 32) ^ index)
+
+
+def random_token(rng, like):
+  '''
+  A string of the same length as like, drawn from rng: hex digits if like
+  is all hex digits, otherwise letters and digits.
+  '''
+  if all(c in string.hexdigits for c in like):
+    alphabet = string.hexdigits[:16]
+  else:
+    alphabet = string.ascii_letters + string.digits
+  return ''.join(rng.choice(alphabet) for c in like)
+
+
+def write(collection, documents, batch_size):
+  '''
+  Inserts documents batch_size at a time, and returns how many there were.
+  '''
+  count = 0
+  batch = []
+  for document in documents:
+    batch.append(document)
+    if len(batch) == batch_size:
+      collection.insert(batch)
+      count += len(batch)
+      batch = []
+  if batch:
+    collection.insert(batch)
+    count += len(batch)
+  return count
+
+
+class Dataset(object):
+  '''
+  The sizes of a generated dataset, and generators of its documents.
+  '''
+  def __init__(self, seed=12345, scale=1.0, event_scale=1.0):
+    from backend import List
+    self.seed = seed
+    self.num_users = max(2, int(NUM_USERS * scale))
+    self.num_classes = max(CLASSES_PER_TEACHER, int(NUM_CLASSES * scale))
+    self.num_teachers = self.num_classes // CLASSES_PER_TEACHER
+    self.num_students = self.num_users - self.num_teachers
+    self.num_lists = max(1, int(NUM_LISTS * scale))
+    self.mean_student_events = (
+        NUM_EVENTS * scale * event_scale / max(1, self.num_students))
+    self.max_list_size = List.max_list_size
+
+    # List sizes are needed again for every event; at two bytes a list
+    # they are cheap to keep.
+    self.list_sizes = array('H')
+    for l in range(self.num_lists):
+      rng = make_rng(self.seed, LIST, l)
+      self.list_sizes.append(min(
+          self.max_list_size,
+          1 + int(rng.expovariate(1.0 / (MEAN_LIST_SIZE - 1)))))
+
+  def username(self, u):
+    if u < self.num_teachers:
+      return 'teacher%d' % u
+    return 'student%d' % (u - self.num_teachers)
+
+  def user_stub(self, u):
+    '''
+    The fields of user u that set_creator and set_user read.
+    '''
+    from backend import User
+    return User({'_id': document_id(USER, u), 'username': self.username(u)})
+
+  def users(self):
+    from backend import User
+    template = User()
+    template.update_user({
+      'username': 'template',
+      'password': PASSWORD,
+      'name': 'Template',
+    })
+    # reset_oauth draws the API key and secret at random; every user gets
+    # its own, in the same format, from its seeded generator.
+    before = dict(template)
+    template.reset_oauth()
+    oauth_fields = sorted(
+        field for field, value in template.items()
+        if isinstance(value, basestring) and value != before.get(field))
+    for u in range(self.num_users):
+      rng = make_rng(self.seed, USER, u)
+      user = dict(template)
+      for field in oauth_fields:
+        user[field] = random_token(rng, template[field])
+      user['_id'] = document_id(USER, u)
+      user['username'] = self.username(u)
+      user['name'] = self.username(u).capitalize()
+      user['points'] = 0
+      user['numMastered'] = 0
+      yield user
+
+  def class_students(self, c):
+    rng = make_rng(self.seed, CLASS, c)
+    size = min(CLASS_SIZE, self.num_students)
+    return [str(document_id(USER, self.num_teachers + s))
+            for s in rng.sample(xrange(self.num_students), size)]
+
+  def classes(self):
+    from backend import Class
+    for c in range(self.num_classes):
+      teacher = c // CLASSES_PER_TEACHER
+      school_class = Class()
+      school_class.update_class({
+        'name': 'Class %d' % c,
+        'students': self.class_students(c),
+      })
+      school_class['_id'] = document_id(CLASS, c)
+      school_class.set_creator(self.user_stub(teacher))
+      yield school_class
+
+  def lists_and_items(self):
+    '''
+    Yields (list, items) for every list.
+    '''
+    from backend import Item, List
+    for l in range(self.num_lists):
+      rng = make_rng(self.seed, LIST, l)
+      # The first draw was the list size.
+      rng.random()
+      creator = self.user_stub(rng.randrange(self.num_teachers))
+      grade = rng.choice(GRADES)
+      item_list = List({
+        'title': 'List %d' % l,
+        'description': 'Synthetic list %d' % l,
+        'format': 'vocabulary',
+        'grade': grade,
+        'standard': 'L.%s.%d' % (grade, rng.randint(1, 6)),
+        'section': 'Vocabulary',
+      })
+      item_list['_id'] = document_id(LIST, l)
+      item_list.set_creator(creator)
+      items = []
+      for i in range(self.list_sizes[l]):
+        item = Item({'word': 'word%d' % i, 'defn': 'definition %d' % i})
+        item['_id'] = document_id(ITEM, l, i)
+        item.set_creator(creator)
+        item_list.add_item(item)
+        items.append(item)
+      yield item_list, items
+
+  def student_sessions(self, s):
+    '''
+    Yields (list id, timestamp, events) for each study session of student
+    s. The events are dicts with the fields of Event documents.
+    '''
+    rng = make_rng(self.seed, EVENT, s)
+    user_id = document_id(USER, self.num_teachers + s)
+    num_events = 0
+    if self.mean_student_events:
+      num_events = int(rng.expovariate(1.0 / self.mean_student_events))
+    timestamp = START_DATE + timedelta(
+        seconds=rng.randrange(STUDY_DAYS * 86400))
+    e = 0
+    while e < num_events:
+      l = rng.randrange(self.num_lists)
+      session_start = timestamp
+      events = []
+      for i in range(min(rng.randint(*SESSION_SIZES), num_events - e)):
+        duration = rng.randint(500, 5000)
+        timestamp += timedelta(milliseconds=duration)
+        events.append({
+          '_id': document_id(EVENT, s, e),
+          'userId': user_id,
+          'itemId': document_id(ITEM, l, rng.randrange(self.list_sizes[l])),
+          'timestamp': timestamp,
+          'outcome': rng.random() < CORRECT_RATE,
+          'duration': duration,
+        })
+        e += 1
+      yield document_id(LIST, l), session_start, events
+      timestamp += timedelta(seconds=int(rng.expovariate(1.0 / 86400)))
+
+  def events(self, students):
+    from backend import Event
+    for s in students:
+      template = Event()
+      template.set_user(self.user_stub(self.num_teachers + s))
+      for list_id, session_start, events in self.student_sessions(s):
+        for event_data in events:
+          event = dict(template)
+          event.update(event_data)
+          yield event
+
+  def replay_student(self, s):
+    '''
+    Records student s' sessions as EventsHandler.POST would.
+    '''
+    from backend import Event, User
+    import data_api
+    log_user = User.collection.find_one(
+        {'_id': document_id(USER, self.num_teachers + s)})
+    for list_id, session_start, events_data in self.student_sessions(s):
+      events = []
+      for event_data in events_data:
+        event = Event(event_data)
+        event.set_user(log_user)
+        events.append(event)
+      data_api.record_event_batches(log_user, [{
+        'listId': list_id,
+        'appId': None,
+        'timestamp': int(time.mktime(session_start.timetuple())),
+        'events': events,
+      }])
+
+
+def generate(dataset, batch_size=1000, replay_users=0):
+  '''
+  Writes the dataset through the document classes' collections.
+  '''
+  from backend import Class, Event, Item, List, User
+  import class_membership
+
+  start = time.time()
+  print '%d users' % write(User.collection, dataset.users(), batch_size)
+
+  num_classes = 0
+  for school_class in dataset.classes():
+    Class.collection.insert(school_class)
+    class_membership.add_students(
+        school_class['_id'], school_class.get('students', []))
+    num_classes += 1
+  print '%d classes' % num_classes
+
+  num_lists = 0
+  items_batch = []
+  lists_batch = []
+  num_items = 0
+  for item_list, items in dataset.lists_and_items():
+    lists_batch.append(item_list)
+    items_batch.extend(items)
+    if len(items_batch) >= batch_size:
+      Item.collection.insert(items_batch)
+      num_items += len(items_batch)
+      items_batch = []
+    if len(lists_batch) == batch_size:
+      List.collection.insert(lists_batch)
+      num_lists += len(lists_batch)
+      lists_batch = []
+  if items_batch:
+    Item.collection.insert(items_batch)
+    num_items += len(items_batch)
+  if lists_batch:
+    List.collection.insert(lists_batch)
+    num_lists += len(lists_batch)
+  print '%d lists, %d items' % (num_lists, num_items)
+
+  replay_users = min(replay_users, dataset.num_students)
+  for s in range(replay_users):
+    dataset.replay_student(s)
+  num_events = write(Event.collection, dataset.events(
+      xrange(replay_users, dataset.num_students)), batch_size)
+  print '%d events, and %d students replayed' % (num_events, replay_users)
+  print 'Generated in %.1f s' % (time.time() - start)
+
+
+def main(options):
+  if options['target'] == 'memory':
+    import memory_backend
+    memory_backend.install()
+  elif options['target'] != 'mongo':
+    print 'Unknown target %s' % options['target']
+    return 1
+
+  dataset = Dataset(int(options['seed']), float(options['scale']),
+                    float(options['event_scale']))
+  generate(dataset, int(options['batch_size']), int(options['replay_users']))
+  return 0
+
+
+if __name__ == '__main__':
+  options = parse_options(DEFAULTS, sys.argv[1:])
+  sys.exit(main(options))
@@ -0,0 +1,236 @@
+'''
+Offline load test of data_api.app and stats_api.app.
+
+Both apps run in process, through web.py's app.request, against the
+in-memory collections of memory_backend: no server and no MongoDB, only the
+server's backend and adaptive_model modules on the path. The harness creates
+--users users and logs each one in through /authenticate. Each user then
+creates --lists lists of --items items through POST /lists/. After that it
+sends --requests requests drawn from a weighted mix:
+
+  list browsing     40%  GET /lists/?num=50 and GET /lists/<id>/
+  adaptive fetches  20%  GET /lists/<id>/?sort=adaptive
+  event batches     30%  POST /events/ with --events item events
+  stats pages       10%  stats GET /lists/, /lists/<id>/ and /standards/
+
+It reports requests/s and p50/p95/p99 latency per endpoint, and the number
+of responses that were not 2xx. Runs are seeded, so the same options send
+the same requests.
+
+Usage: python benchmarks/load_test.py [--requests=2000] [--users=20]
+           [--lists=5] [--items=50] [--events=10] [--threads=1] [--seed=12345]
+'''
+
+from multiprocessing.pool import ThreadPool
+import os
+import random
+import sys
+import threading
+import time
+import urllib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import memory_backend
+database = memory_backend.install()
+
+from backend import User
+from bench_util import parse_options, percentile
+from libraries.python.web_util import decode_json, encode_json
+import data_api
+import indexes
+import stats_api
+
+DEFAULTS = {
+  'requests': 2000,
+  'users': 20,
+  'lists': 5,
+  'items': 50,
+  'events': 10,
+  'threads': 1,
+  'seed': 12345,
+}
+# (endpoint, weight) of the request mix.
+MIX = [
+  ('GET /lists/', 20),
+  ('GET /lists/<id>/', 20),
+  ('GET /lists/<id>/?sort=adaptive', 20),
+  ('POST /events/', 30),
+  ('stats GET /lists/', 4),
+  ('stats GET /lists/<id>/', 4),
+  ('stats GET /standards/', 2),
+]
+GRADES = ['3', '4', '5', '6', '7', '8']
+
+
+class Client(object):
+  '''
+  A logged in user, and the lists and items it created.
+  '''
+  def __init__(self, username, cookie):
+    self.username = username
+    self.cookie = cookie
+    self.list_ids = []
+    self.item_ids = {}
+
+  def request(self, app, path, method='GET', data=None):
+    headers = {'Cookie': self.cookie}
+    if data is not None:
+      data = encode_json(data)
+      headers['Content-Type'] = 'application/json'
+    return app.request(path, method=method, data=data, headers=headers)
+
+
+def is_success(response):
+  return response.status[:1] == '2'
+
+
+def create_user(index):
+  username = 'loadtest%d' % index
+  password = 'password%d' % index
+  user = User()
+  user.update_user({
+    'username': username,
+    'password': password,
+    'name': 'Load Test %d' % index,
+  })
+  user.reset_oauth()
+  user.save()
+
+  response = data_api.app.request('/authenticate/?' + urllib.urlencode(
+      {'username': username, 'password': password}))
+  if not is_success(response) or 'Set-Cookie' not in response.headers:
+    raise RuntimeError('Could not log in %s: %s %s' % (
+        username, response.status, response.data))
+  return Client(username, response.headers['Set-Cookie'].split(';')[0])
+
+
+def create_lists(client, num_lists, num_items, rng):
+  for l in range(num_lists):
+    grade = rng.choice(GRADES)
+    list_data = {
+      'title': '%s list %d' % (client.username, l),
+      'description': 'Load test list',
+      'format': 'vocabulary',
+      'grade': grade,
+      'standard': 'L.%s.4' % grade,
+      'section': 'Vocabulary',
+      'items': [{'word': 'word%d' % i, 'defn': 'definition %d' % i}
+                for i in range(num_items)],
+    }
+    response = client.request(data_api.app, '/lists/', 'POST', list_data)
+    if not is_success(response):
+      raise RuntimeError('Could not create a list: %s %s' % (
+          response.status, response.data))
+    list_id = decode_json(response.data)['id']
+    response = client.request(data_api.app, '/lists/%s/' % list_id)
+    client.list_ids.append(list_id)
+    client.item_ids[list_id] = [
+        item['id'] for item in decode_json(response.data)['items']]
+
+
+def make_request(endpoint, client, num_events, rng):
+  '''
+  Returns (app, path, method, data) for one request of the mix.
+  '''
+  list_id = rng.choice(client.list_ids)
+  if endpoint == 'GET /lists/':
+    return data_api.app, '/lists/?num=50', 'GET', None
+  if endpoint == 'GET /lists/<id>/':
+    return data_api.app, '/lists/%s/' % list_id, 'GET', None
+  if endpoint == 'GET /lists/<id>/?sort=adaptive':
+    return data_api.app, '/lists/%s/?sort=adaptive' % list_id, 'GET', None
+  if endpoint == 'POST /events/':
+    timestamp = int(time.time())
+    events = [{
+      'itemId': rng.choice(client.item_ids[list_id]),
+      'timestamp': timestamp,
+      'outcome': rng.random() < 0.7,
+      'duration': rng.randint(500, 5000),
+    } for e in range(num_events)]
+    return data_api.app, '/events/', 'POST', {
+      'timestamp': timestamp,
+      'listId': list_id,
+      'events': events,
+    }
+  if endpoint == 'stats GET /lists/':
+    return stats_api.app, '/lists/', 'GET', None
+  if endpoint == 'stats GET /lists/<id>/':
+    return stats_api.app, '/lists/%s/' % list_id, 'GET', None
+  return stats_api.app, '/standards/', 'GET', None
+
+
+def choose_endpoint(rng):
+  total = sum(weight for endpoint, weight in MIX)
+  choice = rng.uniform(0, total)
+  for endpoint, weight in MIX:
+    choice -= weight
+    if choice <= 0:
+      return endpoint
+  return MIX[-1][0]
+
+
+def main(options):
+  rng = random.Random(options['seed'])
+  indexes.ensure_indexes(data_api.INDEXES + stats_api.INDEXES)
+
+  start = time.time()
+  clients = [create_user(u) for u in range(options['users'])]
+  for client in clients:
+    create_lists(client, options['lists'], options['items'], rng)
+  print 'Seeded %d users with %d lists of %d items in %.2f s' % (
+      options['users'], options['lists'], options['items'],
+      time.time() - start)
+
+  # Draw the whole run up front, so that it does not depend on how the
+  # threads interleave.
+  planned = []
+  for r in range(options['requests']):
+    endpoint = choose_endpoint(rng)
+    client = rng.choice(clients)
+    planned.append((endpoint, client,
+                    make_request(endpoint, client, options['events'], rng)))
+
+  timings = dict((endpoint, []) for endpoint, weight in MIX)
+  errors = dict((endpoint, 0) for endpoint, weight in MIX)
+  lock = threading.Lock()
+
+  def send(request):
+    endpoint, client, (app, path, method, data) = request
+    request_start = time.time()
+    response = client.request(app, path, method, data)
+    milliseconds = (time.time() - request_start) * 1000
+    with lock:
+      timings[endpoint].append(milliseconds)
+      if not is_success(response):
+        errors[endpoint] += 1
+
+  workers = ThreadPool(options['threads'])
+  try:
+    start = time.time()
+    workers.map(send, planned, chunksize=1)
+    elapsed = time.time() - start
+  finally:
+    workers.close()
+    workers.join()
+
+  print '%d requests on %d threads in %.2f s: %.1f requests/s' % (
+      len(planned), options['threads'], elapsed, len(planned) / elapsed)
+  print '%-32s %7s %9s %9s %9s %9s %6s' % (
+      'endpoint', 'count', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors')
+  for endpoint, weight in MIX:
+    endpoint_timings = sorted(timings[endpoint])
+    if not endpoint_timings:
+      continue
+    print '%-32s %7d %9.1f %9.2f %9.2f %9.2f %6d' % (
+        endpoint, len(endpoint_timings), len(endpoint_timings) / elapsed,
+        percentile(endpoint_timings, 0.5), percentile(endpoint_timings, 0.95),
+        percentile(endpoint_timings, 0.99), errors[endpoint])
+  if sum(errors.values()):
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  options = parse_options(DEFAULTS, sys.argv[1:])
+  sys.exit(main(options))
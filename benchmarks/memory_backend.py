@@ -0,0 +1,605 @@
+'''
+In-memory stand-in for the Mongo collections behind the backend and
+adaptive_model documents, for benchmarks that run without a MongoDB.
+
+install() points the collection of every document class in backend and
+adaptive_model (and the class_membership index) at an InMemoryCollection.
+The document classes themselves are untouched: validation, formatted_dict
+and the rest behave as usual, and find() results are wrapped in the
+document class just as they are with MongoKit.
+
+The collections implement the part of the pymongo API the handlers use:
+find/find_one with sort, skip, limit and projections, insert, save,
+update, remove, find_and_modify, unordered bulk operations and indexes
+(unique indexes are enforced, sparse ones skipping documents without any
+of their fields; the others are only recorded). Queries
+support equality on dotted paths and arrays, $in, $nin, $ne, $gt, $gte,
+$lt, $lte, $exists, $regex, $all, $or, $and and $nor; updates support
+$set, $unset, $inc, $addToSet, $push, $pull and $setOnInsert. Every query
+is a scan, except lookups of a single _id.
+'''
+
+from bson.objectid import ObjectId
+from collections import OrderedDict
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+import copy
+import re
+import threading
+
+_MISSING = object()
+
+
+def _resolve(value, parts):
+  '''
+  Returns the values found at a dotted path, descending into arrays the
+  way Mongo does. An empty list means the path does not exist.
+  '''
+  if not parts:
+    return [value]
+  if isinstance(value, dict):
+    if parts[0] in value:
+      return _resolve(value[parts[0]], parts[1:])
+    return []
+  if isinstance(value, list):
+    if parts[0].isdigit():
+      index = int(parts[0])
+      if index < len(value):
+        return _resolve(value[index], parts[1:])
+      return []
+    values = []
+    for element in value:
+      if isinstance(element, dict):
+        values.extend(_resolve(element, parts))
+    return values
+  return []
+
+
+def _candidates(values):
+  '''
+  The values to compare a condition with: the values themselves, plus the
+  elements of array values.
+  '''
+  candidates = []
+  for value in values:
+    candidates.append(value)
+    if isinstance(value, list):
+      candidates.extend(value)
+  return candidates
+
+
+def _equals(values, expected):
+  if not values:
+    return expected is None
+  if hasattr(expected, 'search'):
+    return any(isinstance(v, basestring) and expected.search(v)
+               for v in _candidates(values))
+  return any(v == expected for v in _candidates(values))
+
+
+def _compare(values, operator, operand):
+  for value in _candidates(values):
+    if value is None or isinstance(value, (list, dict)):
+      continue
+    if operator == '$gt' and value > operand:
+      return True
+    if operator == '$gte' and value >= operand:
+      return True
+    if operator == '$lt' and value < operand:
+      return True
+    if operator == '$lte' and value <= operand:
+      return True
+  return False
+
+
+def _matches_condition(values, condition):
+  if not (isinstance(condition, dict) and condition and
+          all(key.startswith('$') for key in condition)):
+    return _equals(values, condition)
+
+  for operator, operand in condition.iteritems():
+    if operator == '$in':
+      if not any(_equals(values, option) for option in operand):
+        return False
+    elif operator == '$nin':
+      if any(_equals(values, option) for option in operand):
+        return False
+    elif operator == '$ne':
+      if _equals(values, operand):
+        return False
+    elif operator in ('$gt', '$gte', '$lt', '$lte'):
+      if not _compare(values, operator, operand):
+        return False
+    elif operator == '$exists':
+      if bool(values) != bool(operand):
+        return False
+    elif operator == '$regex':
+      flags = 0
+      if 'i' in condition.get('$options', ''):
+        flags |= re.IGNORECASE
+      if not _equals(values, re.compile(operand, flags)):
+        return False
+    elif operator == '$options':
+      continue
+    elif operator == '$all':
+      if not all(_equals(values, option) for option in operand):
+        return False
+    else:
+      raise NotImplementedError('Query operator %s' % operator)
+  return True
+
+
+def matches(document, spec):
+  '''
+  True if the document matches the query spec.
+  '''
+  for field, condition in (spec or {}).iteritems():
+    if field == '$or':
+      if not any(matches(document, clause) for clause in condition):
+        return False
+    elif field == '$and':
+      if not all(matches(document, clause) for clause in condition):
+        return False
+    elif field == '$nor':
+      if any(matches(document, clause) for clause in condition):
+        return False
+    elif not _matches_condition(_resolve(document, field.split('.')),
+                                condition):
+      return False
+  return True
+
+
+def _parent(document, path, create):
+  parts = path.split('.')
+  for part in parts[:-1]:
+    if part not in document:
+      if not create:
+        return None, parts[-1]
+      document[part] = {}
+    document = document[part]
+  return document, parts[-1]
+
+
+def _apply_update(document, update, inserting=False):
+  if not any(key.startswith('$') for key in update):
+    # Replacement document.
+    document_id = document.get('_id')
+    document.clear()
+    document.update(copy.deepcopy(update))
+    if document_id is not None:
+      document['_id'] = document_id
+    return
+
+  for operator, fields in update.iteritems():
+    if operator == '$setOnInsert' and not inserting:
+      continue
+    for path, operand in fields.iteritems():
+      parent, key = _parent(document, path, operator != '$unset')
+      if parent is None:
+        continue
+      if operator in ('$set', '$setOnInsert'):
+        parent[key] = copy.deepcopy(operand)
+      elif operator == '$unset':
+        parent.pop(key, None)
+      elif operator == '$inc':
+        parent[key] = parent.get(key, 0) + operand
+      elif operator in ('$addToSet', '$push'):
+        if isinstance(operand, dict) and '$each' in operand:
+          new_values = operand['$each']
+        else:
+          new_values = [operand]
+        values = parent.setdefault(key, [])
+        for value in new_values:
+          if operator == '$push' or value not in values:
+            values.append(copy.deepcopy(value))
+      elif operator == '$pull':
+        if key in parent:
+          parent[key] = [value for value in parent[key] if value != operand]
+      else:
+        raise NotImplementedError('Update operator %s' % operator)
+
+
+def _upsert_document(spec):
+  '''
+  The document an upsert starts from: the plain equality fields of spec.
+  '''
+  document = {}
+  for field, condition in spec.iteritems():
+    if field.startswith('$') or (
+        isinstance(condition, dict) and
+        any(key.startswith('$') for key in condition)):
+      continue
+    parent, key = _parent(document, field, True)
+    parent[key] = copy.deepcopy(condition)
+  return document
+
+
+def _project(document, fields):
+  if fields is None:
+    return document
+  if isinstance(fields, (list, tuple)):
+    fields = dict((field, 1) for field in fields)
+  fields = dict((field.split('.')[0], value)
+                for field, value in fields.iteritems())
+  if any(value for field, value in fields.iteritems() if field != '_id'):
+    projected = dict((field, value) for field, value in document.iteritems()
+                     if fields.get(field))
+    if fields.get('_id', 1) and '_id' in document:
+      projected['_id'] = document['_id']
+    return projected
+  return dict((field, value) for field, value in document.iteritems()
+              if fields.get(field, 1))
+
+
+def _sort_value(document, field):
+  values = _resolve(document, field.split('.'))
+  if not values:
+    return (0, None)
+  return (1, values[0])
+
+
+class InMemoryCursor(object):
+  def __init__(self, collection, spec, fields=None, sort=None, skip=0,
+               limit=0):
+    self.collection = collection
+    self.spec = spec or {}
+    self.fields = fields
+    self._sort = list(sort or [])
+    self._skip = skip
+    self._limit = limit
+
+  def sort(self, key_or_list, direction=1):
+    if isinstance(key_or_list, basestring):
+      self._sort = [(key_or_list, direction)]
+    else:
+      self._sort = list(key_or_list)
+    return self
+
+  def skip(self, num):
+    self._skip = num
+    return self
+
+  def limit(self, num):
+    self._limit = num
+    return self
+
+  def _documents(self):
+    documents = self.collection._find(self.spec)
+    for field, direction in reversed(self._sort):
+      documents.sort(key=lambda d: _sort_value(d, field),
+                     reverse=direction < 0)
+    return documents
+
+  def count(self, with_limit_and_skip=False):
+    num = len(self.collection._find(self.spec))
+    if with_limit_and_skip:
+      num = max(0, num - self._skip)
+      if self._limit:
+        num = min(num, self._limit)
+    return num
+
+  def explain(self):
+    return {'cursor': 'InMemoryCursor'}
+
+  def __iter__(self):
+    documents = self._documents()[self._skip:]
+    if self._limit:
+      documents = documents[:self._limit]
+    for document in documents:
+      yield self.collection._wrap(_project(document, self.fields))
+
+
+class BulkOperation(object):
+  '''
+  Unordered bulk operation; the operations run in turn on execute(). As
+  with Mongo, operations that hit a duplicate key are reported together in
+  a BulkWriteError once the others have run.
+  '''
+  def __init__(self, collection):
+    self.collection = collection
+    self.operations = []
+
+  def find(self, spec):
+    return BulkFind(self, spec)
+
+  def insert(self, document):
+    self.operations.append(lambda result: self._insert(document, result))
+
+  def _insert(self, document, result):
+    self.collection.insert(document)
+    result['nInserted'] += 1
+
+  def execute(self):
+    result = {'nInserted': 0, 'nMatched': 0, 'nModified': 0, 'nUpserted': 0,
+              'nRemoved': 0, 'writeErrors': []}
+    for index, operation in enumerate(self.operations):
+      try:
+        operation(result)
+      except DuplicateKeyError, e:
+        result['writeErrors'].append(
+            {'index': index, 'code': 11000, 'errmsg': str(e)})
+    if result['writeErrors']:
+      raise BulkWriteError(result)
+    return result
+
+
+class BulkFind(object):
+  def __init__(self, bulk, spec):
+    self.bulk = bulk
+    self.spec = spec
+    self._upsert = False
+
+  def upsert(self):
+    self._upsert = True
+    return self
+
+  def _update(self, update, multi):
+    def run(result):
+      response = self.bulk.collection.update(
+          self.spec, update, upsert=self._upsert, multi=multi)
+      if response['updatedExisting']:
+        result['nMatched'] += response['n']
+        result['nModified'] += response['nModified']
+      elif 'upserted' in response:
+        result['nUpserted'] += 1
+    self.bulk.operations.append(run)
+
+  def update_one(self, update):
+    self._update(update, False)
+
+  def update(self, update):
+    self._update(update, True)
+
+  def replace_one(self, document):
+    self._update(document, False)
+
+  def remove(self):
+    def run(result):
+      result['nRemoved'] += self.bulk.collection.remove(self.spec)['n']
+    self.bulk.operations.append(run)
+
+
+class InMemoryCollection(object):
+  def __init__(self, database, name, document_class=None):
+    self.database = database
+    self.name = name
+    self.document_class = document_class
+    self._documents = OrderedDict()
+    # Unique indexes: tuple of fields -> {key values: _id}.
+    self._unique = {}
+    # Fields of the unique indexes that are sparse.
+    self._sparse = set()
+    self.indexes = []
+    self._lock = threading.RLock()
+
+  def _wrap(self, document):
+    document = copy.deepcopy(document)
+    if self.document_class is None:
+      return document
+    return self.document_class(document)
+
+  def _find(self, spec):
+    with self._lock:
+      if spec and '_id' in spec and not isinstance(spec['_id'], dict):
+        document = self._documents.get(spec['_id'])
+        if document is not None and matches(document, spec):
+          return [document]
+        return []
+      return [document for document in self._documents.itervalues()
+              if matches(document, spec)]
+
+  def _unique_key(self, fields, document):
+    '''
+    The key of document in the unique index on fields, or None if a sparse
+    index leaves it out.
+    '''
+    values = [_resolve(document, field.split('.')) for field in fields]
+    if fields in self._sparse and not any(values):
+      return None
+    return tuple(repr(value) for value in values)
+
+  def _store(self, document):
+    '''
+    Stores a copy of document, replacing any document with the same _id.
+    '''
+    document = copy.deepcopy(dict(document))
+    document_id = document['_id']
+    old_document = self._documents.get(document_id)
+    for fields, keys in self._unique.iteritems():
+      key = self._unique_key(fields, document)
+      if key is not None and keys.get(key, document_id) != document_id:
+        raise DuplicateKeyError(
+            'Duplicate key for %s %s' % (self.name, list(fields)))
+    for fields, keys in self._unique.iteritems():
+      if old_document is not None:
+        keys.pop(self._unique_key(fields, old_document), None)
+      key = self._unique_key(fields, document)
+      if key is not None:
+        keys[key] = document_id
+    self._documents[document_id] = document
+
+  def _delete(self, document_id):
+    document = self._documents.pop(document_id)
+    for fields, keys in self._unique.iteritems():
+      keys.pop(self._unique_key(fields, document), None)
+
+  def find(self, spec=None, fields=None, sort=None, skip=0, limit=0, **kwargs):
+    return InMemoryCursor(self, spec, fields, sort, skip, limit)
+
+  def find_one(self, spec=None, fields=None, **kwargs):
+    if spec is not None and not isinstance(spec, dict):
+      spec = {'_id': spec}
+    for document in self.find(spec, fields).limit(1):
+      return document
+    return None
+
+  def insert(self, doc_or_docs, **kwargs):
+    documents = doc_or_docs
+    if isinstance(doc_or_docs, dict):
+      documents = [doc_or_docs]
+    with self._lock:
+      for document in documents:
+        if document.get('_id') is None:
+          document['_id'] = ObjectId()
+        if document['_id'] in self._documents:
+          raise DuplicateKeyError('Duplicate _id %s' % document['_id'])
+        self._store(document)
+    if isinstance(doc_or_docs, dict):
+      return doc_or_docs['_id']
+    return [document['_id'] for document in documents]
+
+  def save(self, document, **kwargs):
+    with self._lock:
+      if document.get('_id') is None:
+        document['_id'] = ObjectId()
+      self._store(document)
+    return document['_id']
+
+  def update(self, spec, update, upsert=False, multi=False, **kwargs):
+    with self._lock:
+      documents = self._find(spec)
+      if not multi:
+        documents = documents[:1]
+      num_modified = 0
+      for document in documents:
+        updated = copy.deepcopy(document)
+        _apply_update(updated, update)
+        if updated != document:
+          self._store(updated)
+          num_modified += 1
+      if documents or not upsert:
+        return {'n': len(documents), 'nModified': num_modified,
+                'updatedExisting': bool(documents), 'ok': 1.0}
+
+      document = _upsert_document(spec)
+      _apply_update(document, update, inserting=True)
+      if document.get('_id') is None:
+        document['_id'] = ObjectId()
+      self._store(document)
+      return {'n': 1, 'nModified': 0, 'updatedExisting': False,
+              'upserted': document['_id'], 'ok': 1.0}
+
+  def remove(self, spec_or_id=None, multi=True, **kwargs):
+    spec = spec_or_id
+    if spec is not None and not isinstance(spec, dict):
+      spec = {'_id': spec}
+    with self._lock:
+      documents = self._find(spec)
+      if not multi:
+        documents = documents[:1]
+      for document in documents:
+        self._delete(document['_id'])
+    return {'n': len(documents), 'ok': 1.0}
+
+  def find_and_modify(self, query=None, update=None, upsert=False, sort=None,
+                      fields=None, new=False, remove=False, **kwargs):
+    query = query or {}
+    with self._lock:
+      documents = InMemoryCursor(self, query, sort=sort)._documents()
+      if remove:
+        if not documents:
+          return None
+        self._delete(documents[0]['_id'])
+        return self._wrap(_project(documents[0], fields))
+
+      if documents:
+        spec = {'_id': documents[0]['_id']}
+      elif upsert:
+        spec = query
+      else:
+        return None
+      response = self.update(spec, update, upsert=upsert)
+      if not new:
+        if not documents:
+          return None
+        return self._wrap(_project(documents[0], fields))
+      document_id = response.get('upserted', spec.get('_id'))
+      return self._wrap(_project(self._documents[document_id], fields))
+
+  def count(self):
+    return len(self._documents)
+
+  def initialize_unordered_bulk_op(self):
+    return BulkOperation(self)
+
+  initialize_ordered_bulk_op = initialize_unordered_bulk_op
+
+  def create_index(self, keys, **kwargs):
+    if isinstance(keys, basestring):
+      keys = [(keys, 1)]
+    self.indexes.append((list(keys), kwargs))
+    if kwargs.get('unique'):
+      fields = tuple(field for field, direction in keys)
+      with self._lock:
+        if fields not in self._unique:
+          if kwargs.get('sparse'):
+            self._sparse.add(fields)
+          unique_keys = {}
+          for document in self._documents.itervalues():
+            key = self._unique_key(fields, document)
+            if key is None:
+              continue
+            if key in unique_keys:
+              raise DuplicateKeyError(
+                  'Duplicate key for %s %s' % (self.name, list(fields)))
+            unique_keys[key] = document['_id']
+          self._unique[fields] = unique_keys
+
+  ensure_index = create_index
+
+  def drop(self):
+    with self._lock:
+      self._documents.clear()
+      for keys in self._unique.itervalues():
+        keys.clear()
+
+
+class InMemoryDatabase(object):
+  '''
+  Named InMemoryCollections, created on first use.
+  '''
+  def __init__(self):
+    self.collections = {}
+    self._lock = threading.Lock()
+
+  def get_collection(self, name, document_class=None):
+    with self._lock:
+      collection = self.collections.get(name)
+      if collection is None:
+        collection = InMemoryCollection(self, name, document_class)
+        self.collections[name] = collection
+      elif document_class is not None:
+        collection.document_class = document_class
+      return collection
+
+  def __getitem__(self, name):
+    return self.get_collection(name)
+
+
+def document_classes(module):
+  '''
+  The MongoKit document classes defined in a module.
+  '''
+  return [value for value in vars(module).values()
+          if isinstance(value, type) and hasattr(value, 'structure')]
+
+
+def install(database=None):
+  '''
+  Points every document class in backend and adaptive_model, and the class
+  membership index, at in-memory collections. Returns the database.
+  '''
+  import adaptive_model
+  import backend
+  import class_membership
+
+  if database is None:
+    database = InMemoryDatabase()
+  for module in (backend, adaptive_model):
+    for document_class in document_classes(module):
+      name = getattr(document_class, '__collection__', None)
+      if not name:
+        name = document_class.__name__.lower()
+      document_class.collection = database.get_collection(
+          name, document_class)
+  class_membership.collection = database[class_membership.COLLECTION_NAME]
+  return database
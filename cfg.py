@@ -21,3 +21,5 @@ gflags.DEFINE_bool('debug_lvl', True, 'Level of Debugging')
 
 gflags.DEFINE_string('directory','','The name of the directory where the List CSV files are located')
 gflags.DEFINE_string('file','','Name of the CSV file to read')
+
+gflags.DEFINE_integer('upload_chunk_size', 100, 'Number of items sent in each request when uploading the items of a list')
@@ -0,0 +1,100 @@
+'''
+Student to classes membership index.
+
+AssignmentsHandler.GET?student_user_id=... used to scan Class for
+{'students': id} before it could look up the assignments of those classes.
+The class_memberships collection keeps one document per student instead:
+
+  {'_id': <student id>, 'classIds': [<class id>, ...], 'complete': True}
+
+Ids are stored as strings, as they are in Class.students and
+Assignment.classId. Class creation, ClassHandler.PUT and ClassHandler.DELETE
+keep it up to date. Those updates may create the document of a student who
+was not indexed yet, holding only the classes changed since; such documents
+have no complete flag. A lookup of a student whose document is missing or
+not complete scans Class once and marks the document complete, so the index
+needs no separate backfill. rebuild() recreates it from scratch.
+'''
+
+from backend import Class
+
+COLLECTION_NAME = 'class_memberships'
+# Overrides the collection, e.g. to point benchmarks at a scratch database.
+collection = None
+
+
+def get_collection():
+  if collection is not None:
+    return collection
+  return Class.collection.database[COLLECTION_NAME]
+
+
+def add_students(class_id, student_ids):
+  student_ids = set(str(student_id) for student_id in student_ids)
+  if not student_ids:
+    return
+  bulk = get_collection().initialize_unordered_bulk_op()
+  for student_id in student_ids:
+    bulk.find({'_id': student_id}).upsert().update_one(
+        {'$addToSet': {'classIds': str(class_id)}})
+  bulk.execute()
+
+
+def remove_students(class_id, student_ids):
+  student_ids = list(set(str(student_id) for student_id in student_ids))
+  if student_ids:
+    get_collection().update(
+        {'_id': {'$in': student_ids}}, {'$pull': {'classIds': str(class_id)}},
+        multi=True)
+
+
+def update_class_students(class_id, old_student_ids, new_student_ids):
+  '''
+  Records a change to a class' student list.
+  '''
+  old_student_ids = set(str(student_id) for student_id in old_student_ids)
+  new_student_ids = set(str(student_id) for student_id in new_student_ids)
+  add_students(class_id, new_student_ids - old_student_ids)
+  remove_students(class_id, old_student_ids - new_student_ids)
+
+
+def get_class_ids(student_id):
+  '''
+  Returns the ids of the classes the student belongs to.
+  '''
+  student_id = str(student_id)
+  membership = get_collection().find_one({'_id': student_id})
+  if membership is not None and membership.get('complete'):
+    return membership.get('classIds', [])
+
+  # Not indexed yet, or only partly. $addToSet rather than $set, so that a
+  # class added while we were scanning is not lost.
+  class_ids = [str(class_doc['_id']) for class_doc in
+               Class.collection.find({'students': student_id}, {'_id': 1})]
+  membership = get_collection().find_and_modify(
+      {'_id': student_id},
+      {'$addToSet': {'classIds': {'$each': class_ids}},
+       '$set': {'complete': True}},
+      upsert=True, new=True)
+  return membership.get('classIds', [])
+
+
+def rebuild(classes_data=None):
+  '''
+  Recreates the index from class documents with _id and students, by
+  default every class.
+  '''
+  if classes_data is None:
+    classes_data = Class.collection.find({}, {'students': 1})
+  class_ids_by_student = {}
+  for class_doc in classes_data:
+    for student_id in class_doc.get('students', []):
+      class_ids_by_student.setdefault(str(student_id), []).append(
+          str(class_doc['_id']))
+
+  get_collection().remove({})
+  memberships = [{'_id': student_id, 'classIds': class_ids, 'complete': True}
+                 for student_id, class_ids in class_ids_by_student.iteritems()]
+  for start in range(0, len(memberships), 1000):
+    get_collection().insert(memberships[start:start + 1000])
+  return len(memberships)
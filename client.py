@@ -12,8 +12,9 @@ Author: Adam Stepinski
 import gflags
 import oauth2
 import time
-import httplib
+from connection_pool import get_pool
 import sys
+import urllib
 from libraries.python.web_util import encode_json, decode_json
 
 DEFAULT_HOST = 'openminds.root-1.com'
@@ -30,18 +31,21 @@ gflags.DEFINE_string('om_access_token', '', 'OpenMindsAPI access token. Used by
 class AbstractOpenMindsClient(object):
   '''
   Abstract OpenMindsClient class. Subclasses should implement the _api_response()
-  method, which should return the response from an HTTPConnection object.
+  method, which should return a response object with a read() method.
   '''
-  def __init__(self, host=None):
+  def __init__(self, host=None, pool_size=None):
     if host:
       self.host = host
     else:
       self.host = DEFAULT_HOST
+    self.pool = get_pool(self.host, pool_size)
+    # Responses to conditional GETs, keyed by path.
+    self._cache = {}
     
-  def _api_response(self, method, path, body={}):
+  def _api_response(self, method, path, body={}, params={}, headers={}):
     '''
     Implemented by subclasses. Should return a response
-    from an HTTPConnection object.
+    from the client's connection pool.
     '''
     return None
 
@@ -49,9 +53,56 @@ class AbstractOpenMindsClient(object):
     response = self._api_response(method, path, body, params).read()
     return decode_json(response)
 
+  def _get_cached_json(self, path):
+    '''
+    GETs path, sending the validators of our cached copy. If the server
+    answers 304 Not Modified, the cached copy is returned instead.
+    '''
+    cached = self._cache.get(path)
+    headers = {}
+    if cached:
+      headers['If-None-Match'] = cached['etag']
+
+    response = self._api_response('GET', path, headers=headers)
+    if response.status == 304 and cached:
+      return cached['json']
+
+    json = decode_json(response.read())
+    etag = response.getheader('ETag')
+    if etag and response.status == 200:
+      self._cache[path] = {'etag': etag, 'json': json}
+    else:
+      self._cache.pop(path, None)
+    return json
+
+  def _iter_pages(self, path, params):
+    '''
+    Generator over every document of a paged collection. Pages are only
+    requested as the caller consumes the previous one.
+    '''
+    params = dict(params)
+    params['cursor'] = ''
+    while True:
+      page = self._get_json('GET', path, params=params)
+      for document in page['data']:
+        yield document
+      if not page['hasMore']:
+        return
+      params['cursor'] = page['cursor']
+
   def get_users(self):
     return self._get_json('GET', '/api/data/users/')
 
+  def iter_users(self, params={}):
+    return self._iter_pages('/api/data/users/', params)
+
+  def get_users_by_username(self, usernames):
+    return self._get_json(
+        'GET', '/api/data/users/', params={'username': usernames})
+
+  def update_users(self, updates):
+    return self._get_json('PUT', '/api/data/users/', updates)
+
   def get_user(self, user_id):
     return self._get_json('GET', '/api/data/users/%s/' % user_id)
 
@@ -61,6 +112,9 @@ class AbstractOpenMindsClient(object):
   def create_user(self, info):
     return self._get_json('POST', '/api/data/users/', info)
 
+  def create_users(self, infos):
+    return self._get_json('POST', '/api/data/users/', infos)
+
   def get_class(self, class_id):
     return self._get_json('GET', '/api/data/classes/%s/' % class_id)
 
@@ -73,8 +127,11 @@ class AbstractOpenMindsClient(object):
   def get_lists(self, params={}):
     return self._get_json('GET', '/api/data/lists/', params=params)
 
+  def iter_lists(self, params={}):
+    return self._iter_pages('/api/data/lists/', params)
+
   def get_list(self, list_id):
-    return self._get_json('GET', '/api/data/lists/%s/' % list_id)
+    return self._get_cached_json('/api/data/lists/%s/' % list_id)
 
   def update_list(self, list_id, info):
     return self._get_json('PUT', '/api/data/lists/%s/' % list_id, info)
@@ -82,8 +139,42 @@ class AbstractOpenMindsClient(object):
   def create_list(self, info):
     return self._get_json('POST', '/api/data/lists/', info)
 
+  def delete_lists(self, params):
+    return self._get_json('DELETE', '/api/data/lists/', params=params)
+
+  def create_list_with_items(self, info, items):
+    '''
+    Creates a list and its items in one request. Returns the new list and
+    one {'id': ..., 'error': ...} result per item, in the order of items.
+
+    If the server rejects the request, the list is created on its own. If
+    that succeeds, the embedded items were what the server rejected, as
+    servers without support for them do, and the items are added to the new
+    list with one create_items request. Otherwise the error is returned and
+    nothing has been created.
+    '''
+    data = dict(info)
+    data['items'] = items
+    new_list = self.create_list(data)
+    if 'error' not in new_list:
+      return new_list, embedded_item_results(items, new_list)
+
+    new_list = self.create_list(info)
+    if 'error' in new_list:
+      return new_list, [{'id': None, 'error': new_list['error']}
+                        for item in items]
+    items_json = self.create_items(new_list['id'], items)
+    if isinstance(items_json, list) and len(items_json) == len(items):
+      return new_list, [{'id': item_json.get('id'),
+                         'error': item_json.get('error')}
+                        for item_json in items_json]
+    # The request failed as a whole.
+    error = isinstance(items_json, dict) and items_json.get('error')
+    return new_list, [{'id': None, 'error': error or 'Unexpected response'}
+                      for item in items]
+
   def get_item(self, list_id, item_id):
-    return self._get_json('GET', '/api/data/lists/%s/%s/' % (list_id, item_id))
+    return self._get_cached_json('/api/data/lists/%s/%s/' % (list_id, item_id))
 
   def update_item(self, list_id, item_id, info):
     return self._get_json('PUT', '/api/data/lists/%s/%s/' % (list_id, item_id), info)
@@ -91,6 +182,9 @@ class AbstractOpenMindsClient(object):
   def create_item(self, list_id, info):
     return self._get_json('POST', '/api/data/lists/%s/' % list_id, info)
 
+  def create_items(self, list_id, infos):
+    return self._get_json('POST', '/api/data/lists/%s/' % list_id, infos)
+
   def get_assignment(self, assignment_id):
     return self._get_json('GET', '/api/data/assignments/%s/' % (assignment_id))
 
@@ -118,14 +212,36 @@ class AbstractOpenMindsClient(object):
     return self._get_json('POST', '/api/data/assignment_templates/', info)
 
 
+def embedded_item_results(items, new_list):
+  '''
+  One {'id': ..., 'error': ...} result per item, from the response to a
+  list created with embedded items: the items that were created appear in
+  the new list in order, and the others are listed in 'itemErrors' by index.
+  '''
+  errors = dict((error['index'], error['error'])
+                for error in new_list.get('itemErrors', []))
+  created = iter(new_list.get('items', []))
+  results = []
+  for index in range(len(items)):
+    result = {'id': None, 'error': errors.get(index)}
+    if result['error'] is None:
+      item_json = next(created, None)
+      if item_json and 'id' in item_json:
+        result['id'] = item_json['id']
+      else:
+        result['error'] = 'No item id in response'
+    results.append(result)
+  return results
+
+
 class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
   '''
   Client to access the OpenMinds API using oAuth two-legged authentication. The
   user provides an API key and API secret, which are used to securely sign the
   request.
   '''
-  def __init__(self, key, secret, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, key, secret, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.key = key
     self.secret = secret
 
@@ -147,7 +263,7 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
     req.sign_request(signature_method, consumer, None)
     return req
 
-  def _api_response(self, method, path, body={}, params={}):
+  def _api_response(self, method, path, body={}, params={}, headers={}):
     '''
     Signs the request using the oauth2 library.
     '''
@@ -155,13 +271,10 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
     req = self._get_request(method, path, str_body, extra_params=params)
     data = req.to_postdata()
 
-    connection = httplib.HTTPConnection(self.host)
     if self.host.startswith('localhost') and method == 'POST':
       # Workaround for sending api POST requests to local server.
-      connection.request(method, path, data)
-    else:
-      connection.request(method, path + '?' + data, str_body)
-    return connection.getresponse()
+      return self.pool.request(method, path, data, headers)
+    return self.pool.request(method, path + '?' + data, str_body, headers)
 
   def get_game_url(self, game_id, list_id, params):
     path = '/game/%s/%s/' % (game_id, list_id)
@@ -176,29 +289,27 @@ class OpenMindsThreeLeggedClient(AbstractOpenMindsClient):
   an app access through the web interface. The access token is used by the app
   to get access to the API on behalf of the user.
   '''
-  def __init__(self, access_token, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, access_token, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.access_token = access_token
 
-  def _api_response(self, method, path, body=None):
+  def _api_response(self, method, path, body=None, params={}, headers={}):
     '''
     Includes the access token as a header in the request.
     '''
-    connection = httplib.HTTPConnection(self.host)
     if body:
       data = encode_json(body)
     else:
       data = None
-    headers = {
-      'X-OpenMinds-Access-Token': self.access_token
-    }
+    if params:
+      path += '?' + urllib.urlencode(params, True)
+    headers = dict(headers)
+    headers['X-OpenMinds-Access-Token'] = self.access_token
     if method == 'GET':
       if data:
-        path += '?' + data
-      connection.request(method, path, None, headers)
-    else:
-      connection.request(method, path, data, headers)
-    return connection.getresponse()
+        path += ('&' if params else '?') + data
+      return self.pool.request(method, path, None, headers)
+    return self.pool.request(method, path, data, headers)
 
 
 if __name__ == '__main__':
@@ -207,7 +318,7 @@ if __name__ == '__main__':
   '''
   argv = FLAGS(sys.argv)
   if FLAGS.om_access_token:
-    client = OpenMindsThreeLeggedClient(FLAGS.om_access_token, FLAGS.om_host)
+    client = OpenMindsThreeLeggedClient(FLAGS.om_access_token, FLAGS.om_host, FLAGS.om_pool_size)
   else:
-    client = OpenMindsTwoLeggedClient(FLAGS.om_key, FLAGS.om_secret, FLAGS.om_host)
+    client = OpenMindsTwoLeggedClient(FLAGS.om_key, FLAGS.om_secret, FLAGS.om_host, FLAGS.om_pool_size)
   print client.get_user('me')
@@ -0,0 +1,184 @@
+'''
+Keep-alive HTTP connection pooling for the OpenMinds API clients.
+
+Every client used to open a fresh httplib.HTTPConnection per API call, so a
+bulk upload paid one TCP handshake per item. The pool below keeps HTTP/1.1
+connections open between calls and hands them back out, checking that an
+idle socket has not been closed by the server before reusing it.
+'''
+
+import gflags
+import httplib
+import logging
+import select
+import socket
+import threading
+import time
+
+DEFAULT_POOL_SIZE = 4
+# Seconds a connection may sit idle before we stop trusting it. Most front
+# ends drop keep-alive sockets after 60 seconds or so.
+DEFAULT_IDLE_TIMEOUT = 30
+
+# Methods that may be resent after any failure on a reused connection.
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+FLAGS = gflags.FLAGS
+gflags.DEFINE_integer('om_pool_size', DEFAULT_POOL_SIZE, 'Maximum number of keep-alive connections opened to a single OpenMinds host.')
+
+
+class PooledResponse(object):
+  '''
+  A fully read HTTP response. The body is consumed up front so that the
+  underlying connection can go straight back to the pool; callers use it
+  exactly like an httplib.HTTPResponse.
+  '''
+  def __init__(self, response):
+    self.status = response.status
+    self.reason = response.reason
+    self.msg = response.msg
+    self._body = response.read()
+
+  def read(self):
+    return self._body
+
+  def getheader(self, name, default=None):
+    return self.msg.getheader(name, default)
+
+  def getheaders(self):
+    return self.msg.items()
+
+
+class HTTPConnectionPool(object):
+  '''
+  Pool of keep-alive connections to a single host. At most maxsize
+  connections are in use at once; further requests block until one is
+  released.
+  '''
+  def __init__(self, host, maxsize=DEFAULT_POOL_SIZE,
+               idle_timeout=DEFAULT_IDLE_TIMEOUT, timeout=None):
+    self.host = host
+    self.maxsize = maxsize
+    self.idle_timeout = idle_timeout
+    self.timeout = timeout
+    self._idle = []
+    self._lock = threading.Lock()
+    self._slots = threading.BoundedSemaphore(maxsize)
+
+  def _new_connection(self):
+    if self.timeout is None:
+      return httplib.HTTPConnection(self.host)
+    return httplib.HTTPConnection(self.host, timeout=self.timeout)
+
+  def _is_stale(self, connection, last_used):
+    '''
+    An idle connection is stale if it has been idle for too long, or if its
+    socket is readable: with no request outstanding that can only mean the
+    server closed it (or sent something we will never read).
+    '''
+    if connection.sock is None:
+      return True
+    if time.time() - last_used > self.idle_timeout:
+      return True
+    try:
+      readable, _, _ = select.select([connection.sock], [], [], 0)
+    except (select.error, socket.error, ValueError):
+      return True
+    return bool(readable)
+
+  def _get_connection(self):
+    '''
+    Returns (connection, reused). Stale idle connections are closed and
+    discarded along the way.
+    '''
+    while True:
+      with self._lock:
+        if not self._idle:
+          break
+        connection, last_used = self._idle.pop()
+      if self._is_stale(connection, last_used):
+        connection.close()
+        continue
+      return connection, True
+    return self._new_connection(), False
+
+  def _put_connection(self, connection):
+    with self._lock:
+      self._idle.append((connection, time.time()))
+
+  def _can_retry(self, method, sent, error):
+    '''
+    Whether a request that failed on a reused connection can be resent.
+    Safe methods always can. Others (a POST creating a user, say) only if
+    the failure shows the server never took the request: the write itself
+    failed, or the server closed the connection without a status line.
+    Anything later, like a read timeout, may follow a request the server
+    has already carried out.
+    '''
+    if method.upper() in SAFE_METHODS:
+      return True
+    return not sent or isinstance(error, httplib.BadStatusLine)
+
+  def request(self, method, path, body=None, headers={}):
+    '''
+    Sends the request on a pooled connection and returns a PooledResponse.
+    A request that fails on a reused connection may be retried once on a
+    fresh one (see _can_retry), since the server may have dropped the socket
+    between our health check and the write.
+    '''
+    self._slots.acquire()
+    try:
+      connection, reused = self._get_connection()
+      while True:
+        sent = False
+        try:
+          connection.request(method, path, body, headers)
+          sent = True
+          response = connection.getresponse()
+          pooled_response = PooledResponse(response)
+        except (httplib.HTTPException, socket.error), e:
+          connection.close()
+          if not (reused and self._can_retry(method, sent, e)):
+            raise
+          logging.info('Retrying %s %s on a new connection: %s' %
+                       (method, path, e))
+          connection, reused = self._new_connection(), False
+          continue
+
+        if response.will_close:
+          connection.close()
+        else:
+          self._put_connection(connection)
+        return pooled_response
+    finally:
+      self._slots.release()
+
+  def close(self):
+    '''
+    Closes every idle connection. Connections in use are closed by their
+    callers as usual.
+    '''
+    with self._lock:
+      idle, self._idle = self._idle, []
+    for connection, last_used in idle:
+      connection.close()
+
+
+# Pools by (host, maxsize).
+_pools = {}
+_pools_lock = threading.Lock()
+
+def get_pool(host, maxsize=None):
+  '''
+  Returns the shared pool for the given host and size, creating it on first
+  use so that every client talking to a host with the same pool size shares
+  the same connections.
+  '''
+  if maxsize is None:
+    maxsize = DEFAULT_POOL_SIZE
+  with _pools_lock:
+    pool = _pools.get((host, maxsize))
+    if pool is None:
+      pool = HTTPConnectionPool(host, maxsize)
+      _pools[(host, maxsize)] = pool
+    return pool
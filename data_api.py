@@ -1,22 +1,35 @@
+# metrics has to be imported before backend opens the Mongo connection.
+from metrics import encode_json, instrument
 from backend import Class, User, List, Item, Event, AssignmentTemplate, Assignment
 from bson.errors import InvalidId
 from bson.objectid import ObjectId
 from common_core import CommonCore
 from datetime import datetime
+from email.utils import formatdate, mktime_tz, parsedate_tz
 from libraries.python import cookies
 from libraries.python.cors_util import add_cors_headers
 from libraries.python.db_models import create_generic_document_from_data
 from libraries.python.db_models import get_generic_document, ValidationError
 from libraries.python.util import permute_indices_by_weight
-from libraries.python.web_util import encode_json, decode_json
+from libraries.python.web_util import decode_json
 from libraries.python.web_util import parse_int_param, parse_int_param_as_bool
+import base64
+import hashlib
 import logging
+import re
+import time
 import util
 
-from pymongo.errors import DuplicateKeyError
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from libraries.python.util import error_response, HTTPError
 from api_util import OpenMindsAPIHandler
 import adaptive_model
+import adaptive_cache
+import class_membership
+import event_queue
+from indexes import Index, QueryShape
+import leaderboard
+import metrics
 from auth import login_optional, login_required
 from auth import public_api_auth, private_api_auth
 from auth import get_user_cookie, set_user_cookie
@@ -45,6 +58,8 @@ urls =(
 
   # PRIVATE APIS
   '/events/?', 'EventsHandler',
+  '/events/queue/?', 'EventQueueHandler',
+  '/metrics/?', 'MetricsHandler',
   '/common_core/([^/]+)/?', 'CommonCoreHandler',
 
   '/littlelives/auth/?', 'LittleLivesAuthenticateHandler',
@@ -52,9 +67,92 @@ urls =(
 
   # TEMP APIS
   '/leaderboard/?', 'LeaderboardHandler',
+  '/leaderboard/rebuild/?', 'LeaderboardRebuildHandler',
 )
 app = web.application(urls, locals())
 
+# Fields that identify a UserItemInfo / UserListInfo document.
+ITEM_INFO_KEY = ('userId', 'itemId')
+LIST_INFO_KEY = ('userId', 'listId')
+# UserItemInfo field counting the item's events. It versions the info: an
+# info is only written over the stored copy it was computed from.
+ITEM_INFO_VERSION = 'totalOutcomes'
+# Times an item info that lost to a concurrent write is recomputed.
+MAX_INFO_WRITE_ATTEMPTS = 5
+# Mongo error codes of a duplicate key.
+DUPLICATE_KEY_CODES = (11000, 11001)
+
+# Count of the user's mastered items, kept up to date by
+# record_event_batches. The backend's User structure predates it, so it is
+# declared here for save() to accept users that carry it.
+User.structure.setdefault('numMastered', int)
+
+# Seconds a client is asked to wait when the event queue is full.
+EVENT_QUEUE_RETRY_AFTER_SECONDS = 5
+
+# Default and largest page sizes of cursor pagination.
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Document field behind updated_timestamp(). It is stored to the
+# millisecond, while updated_timestamp() returns whole seconds, so ETags are
+# built from the field to tell back-to-back edits apart.
+UPDATED_FIELD = 'updated'
+# Document field holding the creation time, set by the first save().
+CREATED_FIELD = 'created'
+
+# Indexes the handlers below rely on; see indexes.py.
+INDEXES = [
+  Index(List, [('deleted', pymongo.ASCENDING), ('grade', pymongo.ASCENDING),
+               ('standard', pymongo.ASCENDING),
+               ('section', pymongo.ASCENDING)]),
+  Index(List, [('creator', pymongo.ASCENDING), ('deleted', pymongo.ASCENDING)]),
+  # Sparse: users addressed by token have no username.
+  Index(User, [('username', pymongo.ASCENDING)], unique=True, sparse=True),
+  Index(User, [('creator', pymongo.ASCENDING), ('deleted', pymongo.ASCENDING)]),
+  Index(User, [('points', pymongo.DESCENDING)]),
+  Index(Class, [('students', pymongo.ASCENDING)]),
+  Index(Class, [('creator', pymongo.ASCENDING), ('deleted', pymongo.ASCENDING)]),
+  Index(Assignment, [('classId', pymongo.ASCENDING),
+                     ('deleted', pymongo.ASCENDING)]),
+  Index(Assignment, [('creator', pymongo.ASCENDING),
+                     ('deleted', pymongo.ASCENDING)]),
+  # Unique, so that the info upserts cannot create duplicates.
+  Index(adaptive_model.UserItemInfo,
+        [(field, pymongo.ASCENDING) for field in ITEM_INFO_KEY], unique=True),
+  Index(adaptive_model.UserListInfo,
+        [(field, pymongo.ASCENDING) for field in LIST_INFO_KEY], unique=True),
+]
+
+# Representative queries of the handlers below, for indexes.py --check.
+QUERY_SHAPES = [
+  QueryShape('lists search', List,
+             {'deleted': False, 'grade': 3, 'standard': 'RL', 'section': 1}),
+  QueryShape('lists created by user', List,
+             {'deleted': False, 'creator': ObjectId()}),
+  QueryShape('user by username', User,
+             {'username': {'$in': ['username']}, 'deleted': False}),
+  QueryShape('users created by user', User,
+             {'creator': ObjectId(), 'deleted': False}),
+  QueryShape('leaderboard', User,
+             {'points': {'$exists': True},
+              '$or': [{'flagged': {'$exists': False}}, {'flagged': False}]},
+             [('points', pymongo.DESCENDING)]),
+  QueryShape('classes of student', Class, {'students': str(ObjectId())}),
+  QueryShape('classes of teacher', Class,
+             {'creator': ObjectId(), 'deleted': False}),
+  QueryShape('assignments of classes', Assignment,
+             {'deleted': False, 'classId': {'$in': [str(ObjectId())]}}),
+  QueryShape('assignments of teacher', Assignment,
+             {'deleted': False, 'creator': ObjectId()}),
+  QueryShape('item stats for adaptive sort', adaptive_model.UserItemInfo,
+             {'userId': ObjectId(), 'itemId': {'$in': [ObjectId()]}}),
+  QueryShape('mastered items of user', adaptive_model.UserItemInfo,
+             {'userId': ObjectId(), 'mastered': True}),
+  QueryShape('list info of user', adaptive_model.UserListInfo,
+             {'userId': ObjectId(), 'listId': ObjectId()}),
+]
+
 def can_see_student_data(auth_user, student_user_id):
   """
   Can the authenticated user view data for this student?
@@ -81,8 +179,160 @@ def can_see_class_data(auth_user, class_id):
   return class_item is not None
 
 
-def get_lists(auth_user, params):
-  num = parse_int_param(params.num, 50)
+def parse_fields_param(fields_param):
+  """
+  Parse a comma separated fields= parameter. Returns the requested API
+  fields, or None if no fields were requested. Documents are still loaded
+  whole, since formatted_dict reads fields that no API field names; the
+  formatted_dict is trimmed instead.
+  """
+  if not fields_param:
+    return None
+  api_fields = [f.strip() for f in fields_param.split(',') if f.strip()]
+  return api_fields or None
+
+
+def trim_formatted_dict(formatted_dict, api_fields):
+  """
+  Keep only the requested API fields of a formatted_dict.
+  """
+  if api_fields is None:
+    return formatted_dict
+  return dict((f, formatted_dict[f]) for f in api_fields if f in formatted_dict)
+
+
+def make_etag(*parts):
+  """
+  Strong entity tag built from everything the response body depends on.
+  """
+  return '"%s"' % hashlib.md5('|'.join(str(p) for p in parts)).hexdigest()
+
+
+def get_version(document):
+  """
+  Modification time of a document at full resolution, for ETags.
+  """
+  version = document.get(UPDATED_FIELD)
+  if version is None:
+    version = document.updated_timestamp()
+  return version
+
+
+def stamp_new_document(document):
+  """
+  Sets the creation and updated times that save() would, for documents
+  written with a batch insert instead.
+  """
+  now = datetime.utcnow()
+  if document.get(CREATED_FIELD) is None:
+    document[CREATED_FIELD] = now
+  document[UPDATED_FIELD] = now
+
+
+def touch_document(document_class, document_id):
+  """
+  Moves a document's updated time to now without rewriting the document.
+  """
+  document_class.collection.update(
+      {'_id': document_id}, {'$set': {UPDATED_FIELD: datetime.utcnow()}})
+
+
+def not_modified(etag, last_modified=None):
+  """
+  Sets the ETag (and Last-Modified, a unix timestamp) validators on the
+  response. Returns True if the client's copy is still current, in which
+  case the status is set to 304 and the caller should return an empty body.
+  If-Modified-Since only has a resolution of seconds, so it is not honoured
+  for a resource modified during the current second.
+  """
+  web.header('ETag', etag)
+  if last_modified is not None:
+    web.header('Last-Modified', formatdate(last_modified, usegmt=True))
+
+  if_none_match = web.ctx.env.get('HTTP_IF_NONE_MATCH')
+  if if_none_match is not None:
+    tags = [t.strip() for t in if_none_match.split(',')]
+    current = etag in tags or '*' in tags
+  else:
+    if_modified_since = web.ctx.env.get('HTTP_IF_MODIFIED_SINCE')
+    parsed = if_modified_since and parsedate_tz(if_modified_since)
+    current = bool(parsed and last_modified is not None and
+                   int(last_modified) <= mktime_tz(parsed) and
+                   int(last_modified) < int(time.time()))
+
+  if current:
+    web.ctx.status = '304 Not Modified'
+  return current
+
+
+def encode_cursor(last_id):
+  """
+  Opaque token pointing just past the document with the given id.
+  """
+  return base64.urlsafe_b64encode(str(last_id))
+
+
+def decode_cursor(cursor):
+  """
+  Returns the id encoded in a cursor token, or None for the empty cursor
+  that requests the first page. Raises ValueError for a malformed token.
+  """
+  if not cursor:
+    return None
+  try:
+    return ObjectId(base64.urlsafe_b64decode(str(cursor)))
+  except Exception, e:
+    raise ValueError('Not a valid cursor: %s' % e)
+
+
+def parse_page_size(num):
+  """
+  Parses a num parameter for find_page, clamped to 1 to MAX_PAGE_SIZE.
+  Raises ValueError if it is not an integer.
+  """
+  if num is None or num == '':
+    return DEFAULT_PAGE_SIZE
+  try:
+    num = int(num)
+  except (TypeError, ValueError):
+    raise ValueError('num must be an integer')
+  return max(1, min(num, MAX_PAGE_SIZE))
+
+
+def find_page(collection, spec, cursor, num):
+  """
+  Returns (documents, next_cursor, has_more) for the page of documents
+  matching spec that follows the cursor. Pages are ranges of _id, so each
+  page is an index range scan no matter how deep into the results it is.
+  num is clamped to 1 to MAX_PAGE_SIZE.
+  """
+  num = max(1, min(num, MAX_PAGE_SIZE))
+  last_id = decode_cursor(cursor)
+  if last_id is not None:
+    spec = dict(spec)
+    id_spec = spec.get('_id')
+    if id_spec is None:
+      spec['_id'] = {'$gt': last_id}
+    elif isinstance(id_spec, dict):
+      id_spec = dict(id_spec)
+      id_spec['$gt'] = last_id
+      spec['_id'] = id_spec
+    else:
+      spec['$and'] = [{'_id': spec.pop('_id')}, {'_id': {'$gt': last_id}}]
+
+  # Fetch one extra document to find out whether there is another page.
+  documents = list(collection.find(spec).sort(
+      '_id', pymongo.ASCENDING).limit(num + 1))
+  has_more = len(documents) > num
+  documents = documents[:num]
+  if has_more:
+    next_cursor = encode_cursor(documents[-1]._id)
+  else:
+    next_cursor = None
+  return documents, next_cursor, has_more
+
+
+def get_lists_spec(auth_user, params):
   grade = parse_int_param(params.grade, None)
   section = parse_int_param(params.section, None)
   if params.search in ('all', 'created'):
@@ -100,55 +350,281 @@ def get_lists(auth_user, params):
     # Only add the section to the spec if a standard is also defined.
     if params.section is not None:
       spec['section'] = section
+  return spec
 
+
+def get_lists(auth_user, params):
+  num = parse_int_param(params.num, 50)
+  spec = get_lists_spec(auth_user, params)
   item_lists = List.collection.find(spec).limit(num)
   return item_lists
 
 
-def adaptive_sort_item_list(json_item_list, auth_user):
+def parse_int_filter(params, name):
   """
-  Sort the items in this list by order of 'adaptive learning desirability':
-  A < B if we think given user should practice on A instead of B.
+  Parses the integer filter parameter name, or returns None if it is
+  absent. Raises ValueError if it is not an integer, rather than dropping
+  the filter.
   """
-  # Get any stats for this user and these items.
+  value = params.get(name)
+  if value is None or value == '':
+    return None
+  try:
+    return int(value)
+  except (TypeError, ValueError):
+    raise ValueError('%s must be an integer' % name)
+
+
+def get_bulk_delete_spec(auth_user, params):
+  """
+  Build the spec for deleting several of the authenticated user's lists at
+  once. Lists can be filtered on item count, title regex, tags and creation
+  date. Raises ValueError if no filter narrows the query or a filter is
+  malformed, so that a bare request can never delete every list.
+  """
+  spec = {'deleted': False, 'creator': auth_user._id}
+  has_filter = False
+
+  min_items = parse_int_filter(params, 'min_items')
+  max_items = parse_int_filter(params, 'max_items')
+  # Every list has at least 0 items, so only a positive min_items filters.
+  if min_items is not None and min_items > 0:
+    # A list has at least n items iff its item n-1 exists.
+    spec['items.%d' % (min_items - 1)] = {'$exists': True}
+    has_filter = True
+  if max_items is not None:
+    if max_items < 0:
+      raise ValueError('max_items must not be negative')
+    spec['items.%d' % max_items] = {'$exists': False}
+    has_filter = True
+
+  if params.title is not None:
+    try:
+      re.compile(params.title)
+    except re.error, e:
+      raise ValueError('Not a valid title regex: %s' % e)
+    spec['title'] = {'$regex': params.title}
+    has_filter = True
+
+  if params.tag:
+    spec['tags'] = {'$all': params.tag}
+    has_filter = True
+
+  # The creation time is encoded in the object id.
+  id_range = {}
+  for name, operator in (('created_after', '$gte'),
+                         ('created_before', '$lt')):
+    timestamp = parse_int_filter(params, name)
+    if timestamp is None:
+      continue
+    try:
+      id_range[operator] = ObjectId.from_datetime(
+          datetime.utcfromtimestamp(timestamp))
+    except (ValueError, OverflowError):
+      raise ValueError('%s is out of range' % name)
+  if id_range:
+    spec['_id'] = id_range
+    has_filter = True
+
+  if not has_filter:
+    raise ValueError('At least one list filter is required')
+  return spec
+
+
+def get_adaptive_item_blobs(json_item_list, auth_user):
+  """
+  Tie each item json to any known stats or scores for the given user.
+  """
+  # Get any stats for this user and these items, indexed by item id.
   item_ids = [ObjectId(item['id']) for item in json_item_list]
   spec = {'userId': auth_user._id, 'itemId': {'$in': item_ids}}
-  item_stats = list(adaptive_model.UserItemInfo.collection.find(spec))
+  stats_by_item_id = dict(
+      (str(item_stat.itemId), item_stat)
+      for item_stat in adaptive_model.UserItemInfo.collection.find(spec))
 
-  # Make an array tying item json (what we will be returning) to any
-  # known stats or scores,
   item_blobs = []
   for json_item in json_item_list:
     item_blob = {}
     item_blob['json'] = json_item
     item_blob['stat'] = None
     item_blob['masteryScore'] = -1
-    for item_stat in item_stats:
-      if str(item_stat.itemId) == json_item['id']:
-        item_blob['stat'] = item_stat
-        item_blob['masteryScore'] = item_stat.calculate_mastery_score()
-        item_blob['masteryThreshold'] = item_stat.get_mastery_threshold()
-        break
+    item_stat = stats_by_item_id.get(json_item['id'])
+    if item_stat is not None:
+      item_blob['stat'] = item_stat
+      item_blob['masteryScore'] = item_stat.calculate_mastery_score()
+      item_blob['masteryThreshold'] = item_stat.get_mastery_threshold()
 
     item_blobs.append(item_blob)
+  return item_blobs
+
+
+def adaptive_sort_item_list(json_item_list, auth_user, list_id=None):
+  """
+  Sort the items in this list by order of 'adaptive learning desirability':
+  A < B if we think given user should practice on A instead of B.
+  If list_id is given, the weights are cached per user and list until new
+  events come in for the list's items.
+  """
+  item_id_strs = [item['id'] for item in json_item_list]
+  weights = None
+  if list_id is not None:
+    weights = adaptive_cache.order_cache.get(
+        auth_user._id, list_id, item_id_strs)
+
+  item_blobs = None
+  if weights is None:
+    item_blobs = get_adaptive_item_blobs(json_item_list, auth_user)
+    weights = adaptive_model.get_adaptive_weights(item_blobs)
+    if list_id is not None:
+      adaptive_cache.order_cache.put(
+          auth_user._id, list_id, item_id_strs, weights)
 
-  weights = adaptive_model.get_adaptive_weights(item_blobs)
   indices = permute_indices_by_weight(weights)
-  new_json_list = []
-  for index in indices:
-    new_json_list.append(item_blobs[index]['json'])
-    logging.debug("  " + item_blobs[index]['json'].get('word', 'word'))
-    logging.debug("    weight:" + str(weights[index]))
-    logging.debug("    MasteryScore:" + str(item_blobs[index]['masteryScore']))
+  new_json_list = [json_item_list[index] for index in indices]
+
+  if logging.getLogger().isEnabledFor(logging.DEBUG):
+    for index in indices:
+      logging.debug("  " + json_item_list[index].get('word', 'word'))
+      logging.debug("    weight:" + str(weights[index]))
+      if item_blobs is not None:
+        logging.debug(
+            "    MasteryScore:" + str(item_blobs[index]['masteryScore']))
 
   return new_json_list
 
 
+def save_info_updates(collection, infos, key_fields, version_field=None):
+  """
+  Write adaptive info documents that each have one more event applied than
+  the stored copy, as upserts keyed on key_fields, with one unordered bulk
+  request. With a version_field (totalOutcomes for item infos), an info is
+  only written over the stored copy it was computed from, so that its
+  counts and the stats derived from them stay consistent when submissions
+  for the same user run concurrently. Returns the infos that lost to a
+  concurrent write; they are to be recomputed and written again.
+  """
+  infos = list(infos)
+  if not infos:
+    return []
+  bulk = collection.initialize_unordered_bulk_op()
+  for info in infos:
+    spec = dict((field, info[field]) for field in key_fields)
+    if version_field is not None:
+      previous_version = info[version_field] - 1
+      if previous_version:
+        spec[version_field] = previous_version
+      else:
+        spec[version_field] = {'$in': [0, None]}
+    fields = dict(
+        (field, value) for field, value in info.iteritems()
+        if field not in key_fields and field not in ('_id', 'mastered'))
+    # A stored copy of another version is not matched, so the upsert tries
+    # to insert a second document for the key and the unique index rejects
+    # it.
+    bulk.find(spec).upsert().update_one({'$set': fields})
+  try:
+    bulk.execute()
+  except BulkWriteError, e:
+    errors = e.details['writeErrors']
+    if version_field is None or any(
+        error['code'] not in DUPLICATE_KEY_CODES for error in errors):
+      raise
+    return [infos[error['index']] for error in errors]
+  return []
+
+
+def save_item_infos(log_user, events):
+  """
+  Apply events, which are for distinct items, to log_user's item infos and
+  write them with one bulk request. An info that loses to a concurrent
+  submission is recomputed from the newly stored copy and written again.
+  Returns the infos written, by item id.
+  """
+  events_by_item = dict((str(event.itemId), event) for event in events)
+  item_infos = {}
+  item_keys = events_by_item.keys()
+  for _ in xrange(MAX_INFO_WRITE_ATTEMPTS):
+    if not item_keys:
+      break
+    infos = [adaptive_model.update_user_item_info(log_user,
+                                                  events_by_item[item_key])
+             for item_key in item_keys]
+    conflicts = save_info_updates(adaptive_model.UserItemInfo.collection,
+                                  infos, ITEM_INFO_KEY, ITEM_INFO_VERSION)
+    for info in infos:
+      item_infos[str(info['itemId'])] = info
+    item_keys = [str(info['itemId']) for info in conflicts]
+    for item_key in item_keys:
+      del item_infos[item_key]
+  if item_keys:
+    logging.warn('Dropping events of user %s for items %s after %d '
+                 'conflicting writes' % (log_user._id, item_keys,
+                                         MAX_INFO_WRITE_ATTEMPTS))
+  return item_infos
+
+
+def save_list_infos(log_user, list_events):
+  """
+  Apply (list id, event) pairs, which are for distinct lists, to log_user's
+  list infos and write them with one bulk request.
+  """
+  infos = [adaptive_model.update_user_list_info(log_user, list_id, event)
+           for list_id, event in list_events]
+  save_info_updates(adaptive_model.UserListInfo.collection, infos,
+                    LIST_INFO_KEY)
+
+
+def create_list_items(item_list, items_data, auth_user):
+  """
+  Create a batch of items and add them to item_list. All the new items are
+  written with one insert; saving item_list is left to the caller so that it
+  happens once per request. Items that fail validation, or that do not fit
+  in the list, get an error entry instead of failing the whole batch.
+  Returns one entry per item, in the order of items_data.
+  """
+  results = [None] * len(items_data)
+  new_items = []
+  for index, item_data in enumerate(items_data):
+    try:
+      Item.validate(item_data)
+    except ValidationError, e:
+      results[index] = {'error': e.error}
+      continue
+    except Exception, e:
+      logging.warn(e)
+      results[index] = {'error': 'Not a valid item'}
+      continue
+
+    item = Item(item_data)
+    item.set_creator(auth_user)
+    # Assign the id up front so the item can be added to the list before it
+    # is inserted.
+    item['_id'] = ObjectId()
+    if item_list.add_item(item):
+      new_items.append((index, item))
+    else:
+      results[index] = {
+        'error': 'List cannot contain more than %d items.' % List.max_list_size
+      }
+
+  if new_items:
+    for index, item in new_items:
+      stamp_new_document(item)
+    Item.collection.insert([item for index, item in new_items])
+
+  for index, item in new_items:
+    formatted_dict = item.formatted_dict()
+    formatted_dict['editable'] = item.user_can_update(auth_user)
+    results[index] = formatted_dict
+  return results
+
+
 class AuthenticateHandler(object):
   '''
   Handler to authenticate a user based on a username and password.
   '''
 
+  @instrument
   def GET(self):
     '''
     Authenticates the user based on a username and password. If the
@@ -190,6 +666,7 @@ class ClassesHandler(OpenMindsAPIHandler):
   new classes.
   '''
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, auth_user=None, auth_app_id=None):
@@ -209,6 +686,7 @@ class ClassesHandler(OpenMindsAPIHandler):
       logging.error(e)
       return error_response(500, 'Server Error')
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def POST(self, auth_user=None, auth_app_id=None):
@@ -236,6 +714,8 @@ class ClassesHandler(OpenMindsAPIHandler):
       school_class.reset_code()
       school_class.set_creator(auth_user)
       school_class.save()
+      class_membership.add_students(
+          school_class._id, school_class.get('students', []))
       response = {
         'id': str(school_class._id),
         'code': school_class.code,
@@ -251,6 +731,7 @@ class ClassHandler(OpenMindsAPIHandler):
   or updating/deleting a class' information.
   '''
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, class_id=None, auth_user=None, auth_app_id=None):
@@ -265,6 +746,7 @@ class ClassHandler(OpenMindsAPIHandler):
     formatted_dict = school_class.formatted_dict(extended=True)
     return encode_json(formatted_dict)
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def PUT(self, class_id, auth_user=None, auth_app_id=None):
@@ -296,8 +778,11 @@ class ClassHandler(OpenMindsAPIHandler):
       return error_response(400, e.error)
 
     try:
+      old_students = list(school_class.get('students', []))
       school_class.update_class(data)
       school_class.save()
+      class_membership.update_class_students(
+          school_class._id, old_students, school_class.get('students', []))
       update_json = {'updated': school_class.updated_timestamp()}
       if 'resetCode' in data:
         # Since the class code change happens on the server, we need
@@ -308,6 +793,7 @@ class ClassHandler(OpenMindsAPIHandler):
       logging.error(e)
       return error_response(500)
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def DELETE(self, class_id, auth_user=None, auth_app_id=None):
@@ -328,6 +814,8 @@ class ClassHandler(OpenMindsAPIHandler):
     try:
       school_class.delete()
       school_class.save()
+      class_membership.remove_students(
+          school_class._id, school_class.get('students', []))
       # Delete all assignments associated with this class.
       Assignment.collection.update({
         'classId': class_id,
@@ -351,13 +839,23 @@ class UsersHandler(OpenMindsAPIHandler):
   new users.
   '''
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, auth_user=None, auth_app_id=None):
     '''
     Returns a JSON array of basic information about users.
+    One or more username parameters look users up by username instead.
+
+    If a cursor parameter is given (empty for the first page), returns a
+    page of num users instead: {'data': [...], 'cursor': ..., 'hasMore': ...}.
+    A comma separated fields parameter limits the returned fields.
     '''
-    params = web.input(assignment_id=None, class_id=None)
+    params = web.input(
+        assignment_id=None, class_id=None, username=[], cursor=None, num=50,
+        fields=None)
+    usernames = params.username
+    api_fields = parse_fields_param(params.fields)
 
     class_id = None
     if params.class_id is not None:
@@ -367,7 +865,13 @@ class UsersHandler(OpenMindsAPIHandler):
         logging.warn(e)
         return error_response(400)
 
-    if class_id is None:
+    if usernames:
+      # Served by the unique index on username.
+      users_spec = {
+        'username': {'$in': usernames},
+        'deleted': False,
+      }
+    elif class_id is None:
       # Just find all users created by authenticated user.
       users_spec = {
         'creator': auth_user._id,
@@ -398,24 +902,122 @@ class UsersHandler(OpenMindsAPIHandler):
         logging.error(e)
         return error_response(500)
 
+    cursor = None
+    has_more = False
+    if params.cursor is not None:
+      try:
+        num = parse_page_size(params.num)
+      except ValueError, e:
+        logging.warn(e)
+        return error_response(400, str(e))
+    try:
+      if params.cursor is not None:
+        users, cursor, has_more = find_page(
+            User.collection, users_spec, params.cursor, num)
+      else:
+        users = User.collection.find(users_spec)
+    except ValueError, e:
+      logging.warn(e)
+      return error_response(400, 'Not a valid cursor')
+    except Exception, e:
+      logging.error(e)
+      return error_response(500)
+
     try:
-      users = User.collection.find(users_spec)
-      # Return private data iff we're looking at users created by
-      # authenticated user.
+      if usernames:
+        # Only return private data for users the authenticated user
+        # manages.
+        formatted_users = [
+            u.formatted_dict(private_data=u.user_can_update(auth_user))
+            for u in users]
+      else:
+        # Return private data iff we're looking at users created by
+        # authenticated user.
+        formatted_users = [
+            u.formatted_dict(private_data=(class_id is None)) for u in users]
       formatted_users = [
-          u.formatted_dict(private_data=(class_id is None)) for u in users]
+          trim_formatted_dict(u, api_fields) for u in formatted_users]
+      if params.cursor is not None:
+        return encode_json({
+          'data': formatted_users,
+          'cursor': cursor,
+          'hasMore': has_more,
+        })
       return encode_json(formatted_users)
     except Exception, e:
       logging.error(e)
       return error_response(500)
 
+  @instrument
+  @add_cors_headers
+  @public_api_auth
+  def PUT(self, auth_user=None, auth_app_id=None):
+    '''
+    Updates several users at once. The data is a JSON object mapping
+    usernames to the properties to update. Returns a JSON object mapping
+    each username to its new timestamp, or to an error.
+    '''
+    try:
+      data = decode_json(web.ctx.data)
+      if not isinstance(data, dict):
+        raise ValueError('Expected an object keyed by username')
+    except ValueError, e:
+      logging.warn(e)
+      return error_response(400, 'Could not parse JSON')
 
+    results = {}
+    updates = {}
+    for username, user_data in data.iteritems():
+      try:
+        User.validate(user_data)
+        updates[username] = user_data
+      except ValidationError, e:
+        results[username] = {'error': e.error}
+      except Exception, e:
+        logging.warn(e)
+        results[username] = {'error': 'Not a valid user'}
+
+    try:
+      users = User.collection.find({
+        'username': {'$in': updates.keys()},
+        'deleted': False,
+      })
+      users_by_username = dict((u.get('username'), u) for u in users)
+    except Exception, e:
+      logging.error(e)
+      return error_response(500, 'Server Error')
+
+    for username, user_data in updates.iteritems():
+      user = users_by_username.get(username)
+      if not user:
+        results[username] = {'error': 'User does not exist'}
+        continue
+      if not user.user_can_update(auth_user):
+        results[username] = {'error': 'Forbidden'}
+        continue
+
+      try:
+        user.update_user(user_data)
+        user.save()
+        results[username] = {'updated': user.updated_timestamp()}
+      except DuplicateKeyError, e:
+        logging.warn(e)
+        results[username] = {'error': 'That username already exists.'}
+      except Exception, e:
+        logging.error(e)
+        results[username] = {'error': 'Server Error'}
+
+    return encode_json(results)
+
+
+  @instrument
   @add_cors_headers
   @public_api_auth
   def POST(self, auth_user=None, auth_app_id=None):
     '''
     Creates a new user and returns a JSON object containing the
-    id and auth token for the new user.
+    id and auth token for the new user. The data may also be a JSON array
+    of users, in which case a JSON array of per-user results is returned.
     '''
     params = web.input(data=None)
     try:
@@ -423,6 +1025,8 @@ class UsersHandler(OpenMindsAPIHandler):
         data = decode_json(params.data)
       else:
         data = decode_json(web.ctx.data)
+      if isinstance(data, list):
+        return self.create_users(data, auth_user)
       User.validate(data)
     except ValueError, e:
       logging.warn(e)
@@ -439,6 +1043,9 @@ class UsersHandler(OpenMindsAPIHandler):
       if auth_user:
         user.add_to_acl(auth_user, token)
       user.reset_oauth()
+      # New users start with the counter, so their profile reads never
+      # fall back to counting item infos.
+      user['numMastered'] = 0
       user.save()
       auth_token = get_user_cookie(user._id)
       response = {
@@ -453,6 +1060,80 @@ class UsersHandler(OpenMindsAPIHandler):
       logging.error(e)
       return error_response(500, 'Server Error')
 
+  def create_users(self, users_data, auth_user):
+    '''
+    Creates a batch of users with a single insert. Rows that fail
+    validation or reuse an existing username get an error entry instead of
+    failing the batch. Returns a JSON array with the id and auth token (or
+    the error) of each row, in request order.
+    '''
+    duplicate_message = 'That username already exists.'
+    results = [None] * len(users_data)
+
+    usernames = [u.get('username') for u in users_data
+                 if isinstance(u, dict) and u.get('username') is not None]
+    try:
+      taken = set(u['username'] for u in User.collection.find(
+          {'username': {'$in': usernames}}, {'username': 1}))
+    except Exception, e:
+      logging.error(e)
+      return error_response(500, 'Server Error')
+
+    new_users = []
+    for index, data in enumerate(users_data):
+      try:
+        User.validate(data)
+      except ValidationError, e:
+        results[index] = {'error': e.error}
+        continue
+      except Exception, e:
+        logging.warn(e)
+        results[index] = {'error': 'Not a valid user'}
+        continue
+
+      username = data.get('username')
+      if username is not None:
+        if username in taken:
+          results[index] = {'error': duplicate_message}
+          continue
+        taken.add(username)
+
+      user = User()
+      user.update_user(data)
+      user.set_creator(auth_user)
+      if auth_user:
+        user.add_to_acl(auth_user, data.get('token', None))
+      user.reset_oauth()
+      user['numMastered'] = 0
+      stamp_new_document(user)
+      new_users.append((index, user))
+
+    try:
+      if new_users:
+        User.collection.insert([user for index, user in new_users])
+    except DuplicateKeyError, e:
+      # A username was taken after we checked. Fall back to saving one
+      # user at a time so that only the offending rows fail.
+      logging.warn(e)
+      for index, user in new_users:
+        if user.get('_id') and User.collection.find_one({'_id': user._id}):
+          continue
+        try:
+          user.save()
+        except DuplicateKeyError, e:
+          results[index] = {'error': duplicate_message}
+    except Exception, e:
+      logging.error(e)
+      return error_response(500, 'Server Error')
+
+    for index, user in new_users:
+      if results[index] is None:
+        results[index] = {
+          'id': str(user._id),
+          'authToken': get_user_cookie(user._id),
+        }
+    return encode_json(results)
+
 
 class UserHandler(OpenMindsAPIHandler):
   '''
@@ -468,6 +1149,7 @@ class UserHandler(OpenMindsAPIHandler):
     else:
       return 'id', ObjectId(user_id)
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, user_id, auth_user=None, auth_app_id=None):
@@ -505,26 +1187,22 @@ class UserHandler(OpenMindsAPIHandler):
         return error_response(404, message)
       user_dict = user.formatted_dict()
 
-    try:
-      num_mastered_words = adaptive_model.UserItemInfo.collection.find({
-          'userId': user._id,
-          'totalOutcomes': {
-            '$gte': adaptive_model.MIN_TOTAL_OUTCOMES_FOR_MASTERY
-          },
-          'average': {
-            '$gte': adaptive_model.MIN_AVERAGE_FOR_MASTERY
-          },
-          'volatility': {
-            '$lte': adaptive_model.MAX_VOLATILITY_FOR_MASTERY
-          }
-          }).count()
-    except Exception, e:
-      logging.error(e)
-      return error_response(500)
+    num_mastered_words = user.get('numMastered')
+    if num_mastered_words is None:
+      # Counter not backfilled yet for this user.
+      try:
+        mastered_spec = get_mastered_item_spec()
+        mastered_spec['userId'] = user._id
+        num_mastered_words = adaptive_model.UserItemInfo.collection.find(
+            mastered_spec).count()
+      except Exception, e:
+        logging.error(e)
+        return error_response(500)
 
     user_dict['numMastered'] = num_mastered_words
     return encode_json(user_dict)
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def PUT(self, user_id, auth_user=None, auth_app_id=None):
@@ -589,6 +1267,7 @@ class UserHandler(OpenMindsAPIHandler):
       logging.error(e)
       return error_response(500, 'Server Error')
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def DELETE(self, user_id, auth_user=None, auth_app_id=None):
@@ -648,6 +1327,7 @@ class AssignmentTemplatesHandler(OpenMindsAPIHandler):
   creating new assignment template.
   '''
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, auth_user=None, auth_app_id=None):
@@ -672,6 +1352,7 @@ class AssignmentTemplatesHandler(OpenMindsAPIHandler):
       logging.error(e)
       return error_response(500)
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def POST(self, auth_user=None, auth_app_id=None):
@@ -710,6 +1391,7 @@ class AssignmentTemplateHandler(OpenMindsAPIHandler):
   Handler for getting and updating AssignmentTemplates
   """
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, assignment_template_id, auth_user=None, auth_app_id=None):
@@ -727,6 +1409,7 @@ class AssignmentTemplateHandler(OpenMindsAPIHandler):
     formatted_dict = assignment_template.formatted_dict(depth=depth)
     return encode_json(formatted_dict)
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def PUT(self, assignment_template_id, auth_user=None, auth_app_id=None):
@@ -774,15 +1457,19 @@ class AssignmentsHandler(OpenMindsAPIHandler):
   new assignment.
   '''
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, auth_user=None, auth_app_id=None):
     '''
     Returns a JSON array of basic information about assignment.
+    A comma separated fields parameter limits the returned fields.
     '''
     params = web.input(
-        student_user_id=None, class_id=None, availability=None, num=50)
+        student_user_id=None, class_id=None, availability=None, num=50,
+        fields=None)
     depth = parse_int_param(util.get_header('X-OpenMinds-Depth'), 0)
+    api_fields = parse_fields_param(params.fields)
     try:
       num = parse_int_param(params.num, 50)
     except Exception, e:
@@ -805,8 +1492,8 @@ class AssignmentsHandler(OpenMindsAPIHandler):
       }
       if params.student_user_id is not None:
         try:
-          # Note we don't actually use the converted id, we can search with
-          # just the plain string.  But it's a nice sanity check.
+          # The membership index is keyed by the plain string, but
+          # converting is a nice sanity check.
           student_user_id = ObjectId(params.student_user_id)
         except Exception, e:
           logging.warn(e)
@@ -815,14 +1502,8 @@ class AssignmentsHandler(OpenMindsAPIHandler):
         if not can_see_student_data(auth_user, student_user_id):
           return error_response(401)
 
-        # Find all classes he belongs to.
-        classes_spec = {'students': params.student_user_id}
-        classes_list = Class.collection.find(classes_spec)
-
-        # Now find all assignments for these classes.
-        class_ids = []
-        for class_doc in classes_list:
-          class_ids.append(str(class_doc._id))
+        # Find all classes he belongs to, then all assignments for them.
+        class_ids = class_membership.get_class_ids(student_user_id)
         assignment_spec['classId'] = {'$in': class_ids}
       elif params.class_id is not None:
         try:
@@ -842,13 +1523,15 @@ class AssignmentsHandler(OpenMindsAPIHandler):
             params.availability, Assignment.AVAILABILITY_OPEN)
 
       assignments = Assignment.collection.find(assignment_spec).limit(num)
-      formatted_assignments = [assignment.formatted_dict(depth=depth)
-                             for assignment in assignments]
+      formatted_assignments = [
+          trim_formatted_dict(assignment.formatted_dict(depth=depth), api_fields)
+          for assignment in assignments]
       return encode_json(formatted_assignments)
     except Exception, e:
       logging.error(e)
       return error_response(500)
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def POST(self, auth_user=None, auth_app_id=None):
@@ -908,6 +1591,7 @@ class AssignmentHandler(OpenMindsAPIHandler):
   Handler for getting and updating Assignments
   """
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, assignment_id, auth_user=None, auth_app_id=None):
@@ -924,6 +1608,7 @@ class AssignmentHandler(OpenMindsAPIHandler):
     formatted_dict = assignment.formatted_dict(depth=depth)
     return encode_json(formatted_dict)
       
+  @instrument
   @add_cors_headers
   @public_api_auth
   def PUT(self, assignment_id, auth_user=None, auth_app_id=None):
@@ -986,30 +1671,70 @@ class ListsHandler(OpenMindsAPIHandler):
   new lists.
   '''
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, auth_user=None, auth_app_id=None):
     '''
     Returns a JSON array of basic information about lists created
     by the authenticated user.
+
+    If a cursor parameter is given (empty for the first page), returns a
+    page of lists instead: {'data': [...], 'cursor': ..., 'hasMore': ...}.
+    A comma separated fields parameter limits the returned fields.
     '''
     params = web.input(
-        search=None, num=50, grade=None, standard=None, section=None)
+        search=None, num=50, grade=None, standard=None, section=None,
+        cursor=None, fields=None)
+    api_fields = parse_fields_param(params.fields)
+
+    if params.cursor is not None:
+      try:
+        num = parse_page_size(params.num)
+      except ValueError, e:
+        logging.warn(e)
+        return error_response(400, str(e))
+      try:
+        spec = get_lists_spec(auth_user, params)
+        item_lists, cursor, has_more = find_page(
+            List.collection, spec, params.cursor, num)
+        formatted_lists = [
+            trim_formatted_dict(item_list.formatted_dict(), api_fields)
+            for item_list in item_lists]
+      except ValueError, e:
+        logging.warn(e)
+        return error_response(400, 'Not a valid cursor')
+      except Exception, e:
+        logging.error(e)
+        return error_response(500)
+      return encode_json({
+        'data': formatted_lists,
+        'cursor': cursor,
+        'hasMore': has_more,
+      })
 
     try:
       item_lists = get_lists(auth_user, params)
-      formatted_lists = [item_list.formatted_dict() for item_list in item_lists]
+      formatted_lists = [
+          trim_formatted_dict(item_list.formatted_dict(), api_fields)
+          for item_list in item_lists]
       return encode_json(formatted_lists)
     except Exception, e:
       logging.error(e)
       return error_response(500)
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def POST(self, auth_user=None, auth_app_id=None):
     '''
     Create a new list and returns a JSON object containing the new
     list information.
+
+    The data may embed an 'items' array of item objects, in which case the
+    items are created along with the list and the list is saved once. Items
+    that could not be created are reported in 'itemErrors'. An 'items'
+    array of existing item ids is stored on the list as before.
     '''
     params = web.input(data=None)
     try:
@@ -1017,6 +1742,25 @@ class ListsHandler(OpenMindsAPIHandler):
         data = decode_json(params.data)
       else:
         data = decode_json(web.ctx.data)
+      if not isinstance(data, dict):
+        raise ValueError('List data must be an object')
+    except ValueError, e:
+      logging.warn(e)
+      return error_response(400, 'Could not parse JSON')
+
+    items_data = None
+    if 'items' in data:
+      items = data['items']
+      if not isinstance(items, list):
+        return error_response(400, 'items must be an array')
+      if all(isinstance(item, dict) for item in items):
+        items_data = data.pop('items')
+      elif not all(isinstance(item, basestring) for item in items):
+        message = 'items must be an array of item objects or of item ids'
+        logging.warn(message)
+        return error_response(400, message)
+
+    try:
       List.validate(data)
     except ValueError, e:
       logging.warn(e)
@@ -1028,14 +1772,58 @@ class ListsHandler(OpenMindsAPIHandler):
     try:
       item_list = List(data)
       item_list.set_creator(auth_user)
+      item_results = []
+      if items_data:
+        item_results = create_list_items(item_list, items_data, auth_user)
       item_list.save()
       formatted_dict = item_list.formatted_dict(extended=True)
       formatted_dict['editable'] = item_list.user_can_update(auth_user)
+      if items_data is not None:
+        formatted_dict['itemErrors'] = [
+          {'index': index, 'error': result['error']}
+          for index, result in enumerate(item_results)
+          if 'error' in result
+        ]
       return encode_json(formatted_dict)
     except Exception, e:
       logging.error(e)
       return error_response(500)
 
+  @instrument
+  @add_cors_headers
+  @public_api_auth
+  def DELETE(self, auth_user=None, auth_app_id=None):
+    '''
+    Delete every list created by the authenticated user that matches the
+    given filters, and returns a JSON object containing the number of
+    lists deleted. With dry_run=1 the lists are only counted.
+    '''
+    params = web.input(
+        min_items=None, max_items=None, title=None, tag=[],
+        created_after=None, created_before=None, dry_run=0)
+    try:
+      spec = get_bulk_delete_spec(auth_user, params)
+    except ValueError, e:
+      logging.warn(e)
+      return error_response(400, str(e))
+
+    try:
+      if parse_int_param_as_bool(params.dry_run):
+        count = List.collection.find(spec).count()
+        return encode_json({'count': count, 'dryRun': True})
+
+      # The fields List.delete() and save() would set.
+      result = List.collection.update(spec, {
+        '$set': {
+          'deleted': True,
+          UPDATED_FIELD: datetime.utcnow(),
+        }
+      }, multi=True)
+      return encode_json({'count': result['n'], 'dryRun': False})
+    except Exception, e:
+      logging.error(e)
+      return error_response(500)
+
 
 class ListHandler(OpenMindsAPIHandler):
   '''
@@ -1043,12 +1831,14 @@ class ListHandler(OpenMindsAPIHandler):
   or updating/deleting a list's information.
   '''
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, list_id, auth_user=None, auth_app_id=None):
     '''
     Return a JSON object containing extended information about the
-    specific list.
+    specific list. Supports conditional requests, except for the adaptive
+    sort, whose order differs from one request to the next.
     '''
     try:
       item_list = get_generic_document(list_id, List)
@@ -1057,16 +1847,24 @@ class ListHandler(OpenMindsAPIHandler):
 
     params = web.input(sort=None)
     try:
+      editable = item_list.user_can_update(auth_user)
+      if params.sort != 'adaptive':
+        updated = item_list.updated_timestamp()
+        etag = make_etag(list_id, get_version(item_list), editable)
+        if not_modified(etag, updated):
+          return ''
+
       formatted_dict = item_list.formatted_dict(extended=True)
       if params.sort == 'adaptive' and 'items' in formatted_dict:
         formatted_dict['items'] = \
-          adaptive_sort_item_list(formatted_dict['items'], auth_user)
-      formatted_dict['editable'] = item_list.user_can_update(auth_user)
+          adaptive_sort_item_list(formatted_dict['items'], auth_user, list_id)
+      formatted_dict['editable'] = editable
       return encode_json(formatted_dict)
     except Exception, e:
       logging.error(e)
       return error_response(500, 'Server Error')
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def PUT(self, list_id, auth_user=None, auth_app_id=None):
@@ -1100,11 +1898,14 @@ class ListHandler(OpenMindsAPIHandler):
       logging.error(e)
       return error_response(500)
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def POST(self, list_id, auth_user=None, auth_app_id=None):
     '''
-    Create a new item and add it to the list.
+    Create a new item and add it to the list. The data may also be a JSON
+    array of items, in which case they are all added in one batch and a
+    JSON array of per-item results is returned.
     '''
     try:
       item_list = get_generic_document(list_id, List)
@@ -1123,6 +1924,8 @@ class ListHandler(OpenMindsAPIHandler):
         item_data = decode_json(params.data)
       else:
         item_data = decode_json(web.ctx.data)
+      if isinstance(item_data, list):
+        return self.add_items(item_list, item_data, auth_user)
       Item.validate(item_data)
     except ValueError, e:
       logging.warn(e)
@@ -1149,6 +1952,21 @@ class ListHandler(OpenMindsAPIHandler):
       logging.error(e)
       return error_response(500)
 
+  def add_items(self, item_list, items_data, auth_user):
+    '''
+    Create a batch of items and add them to the list with a single insert
+    and a single list save. Returns a JSON array with one entry per item, in
+    request order.
+    '''
+    try:
+      results = create_list_items(item_list, items_data, auth_user)
+      item_list.save()
+    except Exception, e:
+      logging.error(e)
+      return error_response(500)
+    return encode_json(results)
+
+  @instrument
   @add_cors_headers
   @public_api_auth
   def DELETE(self, list_id, auth_user=None, auth_app_id=None):
@@ -1177,11 +1995,12 @@ class ListHandler(OpenMindsAPIHandler):
 
 
 class ItemHandler(OpenMindsAPIHandler):
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, list_id, item_id, auth_user=None, auth_app_id=None):
     '''
-    Return details for the given item.
+    Return details for the given item. Supports conditional requests.
     '''
     try:
       # Verify that item list exists for the given list id.
@@ -1190,10 +2009,17 @@ class ItemHandler(OpenMindsAPIHandler):
     except HTTPError, e:
       return e.error_response()
 
+    editable = item.user_can_update(auth_user)
+    updated = item.updated_timestamp()
+    etag = make_etag(item_id, get_version(item), editable)
+    if not_modified(etag, updated):
+      return ''
+
     formatted_dict = item.formatted_dict()
-    formatted_dict['editable'] = item.user_can_update(auth_user)
+    formatted_dict['editable'] = editable
     return encode_json(formatted_dict)
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def PUT(self, list_id, item_id, auth_user=None, auth_app_id=None):
@@ -1220,11 +2046,16 @@ class ItemHandler(OpenMindsAPIHandler):
     try:
       item.update(data)
       item.save()
+      # The extended list embeds its items, so bump the list's timestamp
+      # to change its ETag. Only the timestamp is written: saving the list
+      # we loaded could undo items added to it in the meantime.
+      touch_document(List, item_list._id)
       return encode_json(item.formatted_dict())
     except Exception, e:
       logging.error(e)
       return error_response(500)
 
+  @instrument
   @add_cors_headers
   @public_api_auth
   def DELETE(self, list_id, item_id, auth_user=None, auth_app_id=None):
@@ -1269,34 +2100,280 @@ class ItemHandler(OpenMindsAPIHandler):
 
 
 class LeaderboardHandler(OpenMindsAPIHandler):
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, auth_user=None, auth_app_id=None):
     params = web.input(num=20, class_only=0)
     num_entries = parse_int_param(params.num, 20)
+    # Boards are cached per process and updated on every event, so they are
+    # never grown past MAX_ENTRIES on request.
+    num_entries = max(0, min(num_entries, leaderboard.MAX_ENTRIES))
     #class_only = parse_int_param_as_bool(params.class_only)
     class_only = auth_user.get('littlelives_teacher', False)
 
-    spec = {
-      'points': {'$exists': True},
-      '$or': [{'flagged': {'$exists': False}},{'flagged': False}],
-    }
-
+    teacher_id = None
     if class_only:
-      key = 'acl.%s' % str(auth_user._id)
-      spec[key] = {'$exists': True}
-
-    users_data = User.collection.find(
-        spec,
-        {'username': 1, 'name': 1, 'points': 1},
-        sort=[('points', pymongo.DESCENDING)],
-        limit=num_entries)
+      teacher_id = auth_user._id
+
+    def load_users(limit):
+      spec = {
+        'points': {'$exists': True},
+        '$or': [{'flagged': {'$exists': False}},{'flagged': False}],
+      }
+      if teacher_id is not None:
+        key = 'acl.%s' % str(teacher_id)
+        spec[key] = {'$exists': True}
+      return User.collection.find(
+          spec,
+          dict((field, 1) for field in leaderboard.ENTRY_FIELDS),
+          sort=[('points', pymongo.DESCENDING)],
+          limit=limit)
+
+    try:
+      users_data = leaderboard.leaderboards.top(
+          teacher_id, num_entries, load_users)
+    except Exception, e:
+      logging.error(e)
+      return error_response(500)
     users = [User(data) for data in users_data]
     users = [user.formatted_dict() for user in users]
     return encode_json(users)
 
 
+class LeaderboardRebuildHandler(OpenMindsAPIHandler):
+  @instrument
+  @add_cors_headers
+  @private_api_auth
+  def POST(self, auth_user=None, auth_app_id=None):
+    '''Drop the materialized leaderboards so they are rebuilt from scratch.'''
+    leaderboard.leaderboards.clear()
+    return encode_json({'success': True})
+
+
+def add_sampling_records(user_id, list_id, app_id, timestamp, events):
+  """
+  These events represent a 'sampling' of activities on the given list
+  across one or more apps.
+  We want to record a summary of this sampling: at this time user
+  was tested on this list and got this percent right.
+  """
+  outcomes = []
+  for event in events:
+    # We are not going to be searching over these itemIds in the
+    # database, feels a bit saner to store them as strings.
+    outcome = {
+      'itemId': str(event.itemId),
+      'outcome': adaptive_model.event_outcome_is_positive(event),
+    }
+    outcomes.append(outcome)
+  sampling_record = adaptive_model.create_sampling_record(user_id, list_id,
+                                                          app_id, timestamp,
+                                                          outcomes)
+  sampling_record.save()
+
+
+def get_mastered_item_spec():
+  """
+  Spec matching the UserItemInfo documents of items that count as mastered.
+  """
+  return {
+    'totalOutcomes': {'$gte': adaptive_model.MIN_TOTAL_OUTCOMES_FOR_MASTERY},
+    'average': {'$gte': adaptive_model.MIN_AVERAGE_FOR_MASTERY},
+    'volatility': {'$lte': adaptive_model.MAX_VOLATILITY_FOR_MASTERY},
+  }
+
+
+def item_info_is_mastered(item_info):
+  return (
+    item_info.get('totalOutcomes', 0) >=
+        adaptive_model.MIN_TOTAL_OUTCOMES_FOR_MASTERY and
+    item_info.get('average', 0) >= adaptive_model.MIN_AVERAGE_FOR_MASTERY and
+    item_info.get('volatility', 0) <= adaptive_model.MAX_VOLATILITY_FOR_MASTERY)
+
+
+def update_mastered_flags(user_id, item_infos):
+  """
+  Bring the mastered flag of the given item infos in line with their stats.
+  Only documents whose flag actually flips are matched, so concurrent
+  submissions count each crossing of the mastery threshold once. Returns
+  the change in the user's number of mastered items.
+  """
+  mastered_ids = []
+  unmastered_ids = []
+  for item_info in item_infos:
+    if item_info_is_mastered(item_info):
+      mastered_ids.append(item_info['itemId'])
+    else:
+      unmastered_ids.append(item_info['itemId'])
+
+  collection = adaptive_model.UserItemInfo.collection
+  change = 0
+  if mastered_ids:
+    result = collection.update(
+        {'userId': user_id, 'itemId': {'$in': mastered_ids},
+         'mastered': {'$ne': True}},
+        {'$set': {'mastered': True}}, multi=True)
+    change += result['n']
+  if unmastered_ids:
+    result = collection.update(
+        {'userId': user_id, 'itemId': {'$in': unmastered_ids},
+         'mastered': True},
+        {'$set': {'mastered': False}}, multi=True)
+    change -= result['n']
+  return change
+
+
+def repair_num_mastered(user_id):
+  """
+  Recompute the mastered flags of all of a user's item infos and the
+  numMastered counter on the user from them. Used to backfill existing
+  users, and to repair a counter that has drifted.
+  """
+  collection = adaptive_model.UserItemInfo.collection
+  mastered_spec = get_mastered_item_spec()
+  mastered_spec['userId'] = user_id
+  collection.update(mastered_spec, {'$set': {'mastered': True}}, multi=True)
+  collection.update(
+      {'userId': user_id, '$nor': [get_mastered_item_spec()]},
+      {'$set': {'mastered': False}}, multi=True)
+  num_mastered = collection.find(
+      {'userId': user_id, 'mastered': True}).count()
+  User.collection.update(
+      {'_id': user_id}, {'$set': {'numMastered': num_mastered}})
+  return num_mastered
+
+
+def record_event_batches(log_user, batches):
+  """
+  Log validated events for log_user and apply them to the adaptive model.
+  Each batch is one submission: a dict with listId, appId, timestamp and
+  events (Event documents). All the events are inserted together, and the
+  item and list infos are written in bulk requests.
+  """
+  events = [event for batch in batches for event in batch['events']]
+  if events:
+    Event.collection.insert(events)
+
+  # Item and list infos are written in bulk. The update functions read the
+  # stored info, so when an item (or list) comes up again, the pending item
+  # (or list) events are applied first. Events on one list thus still
+  # update its list info one at a time.
+  new_points = 0
+  pending_item_events = {}
+  pending_list_events = {}
+  # Latest info of every item, to update the mastered flags from.
+  item_infos = {}
+  for batch in batches:
+    for event in batch['events']:
+      if event.outcome is True:
+        new_points = new_points + 10
+
+      item_key = str(event.itemId)
+      if item_key in pending_item_events:
+        item_infos.update(
+            save_item_infos(log_user, pending_item_events.values()))
+        pending_item_events.clear()
+      pending_item_events[item_key] = event
+
+      if batch['listId'] is not None:
+        list_key = str(batch['listId'])
+        if list_key in pending_list_events:
+          save_list_infos(log_user, pending_list_events.values())
+          pending_list_events.clear()
+        pending_list_events[list_key] = (batch['listId'], event)
+
+  item_infos.update(save_item_infos(log_user, pending_item_events.values()))
+  save_list_infos(log_user, pending_list_events.values())
+
+  num_mastered_change = update_mastered_flags(log_user._id, item_infos.values())
+
+  # Cached adaptive orderings for these items are now out of date.
+  adaptive_cache.order_cache.invalidate_items(
+      log_user._id, [event.itemId for event in events])
+
+  for batch in batches:
+    add_sampling_records(log_user._id, batch['listId'], batch['appId'],
+                         batch['timestamp'], batch['events'])
+
+  if new_points:
+    fields = dict((field, 1) for field in leaderboard.ENTRY_FIELDS)
+    fields.update({'acl': 1, 'flagged': 1})
+    user_data = User.collection.find_and_modify(
+        {'_id': log_user._id}, {'$inc': {'points': new_points}},
+        fields=fields, new=True)
+    if user_data:
+      log_user.points = user_data['points']
+      leaderboard.leaderboards.update_user(user_data)
+
+  if num_mastered_change:
+    # Users without the counter still count on profile reads until
+    # repair_num_mastered has been run for them. Their numMastered may be
+    # null once the document has been saved with the declared field, so
+    # only numeric counters are incremented.
+    User.collection.update(
+        {'_id': log_user._id, 'numMastered': {'$gte': 0}},
+        {'$inc': {'numMastered': num_mastered_change}})
+
+
+def apply_queued_events(user_id, records):
+  """
+  EventProcessor callback: apply the queued submissions of one user, in the
+  order they were queued.
+  """
+  log_user = User.collection.find_one({'_id': user_id, 'deleted': False})
+  if not log_user:
+    logging.warn('Dropping %d queued event records for missing user %s' %
+                 (len(records), user_id))
+    return
+
+  batches = []
+  for record in records:
+    events = []
+    for event_json in record['events']:
+      event_json = dict(event_json)
+      # Datetimes come back from the file queue as UTC aware datetimes;
+      # the sync path stores naive ones.
+      if event_json['timestamp'].tzinfo is not None:
+        event_json['timestamp'] = event_json['timestamp'].replace(tzinfo=None)
+      event = Event(event_json)
+      event.set_user(log_user)
+      events.append(event)
+    batches.append({
+      'listId': record['listId'],
+      'appId': record['appId'],
+      'timestamp': record['timestamp'],
+      'events': events,
+    })
+  record_event_batches(log_user, batches)
+
+
+event_processor = None
+
+def start_event_processor(journal_dir=None,
+                          max_depth=event_queue.DEFAULT_MAX_DEPTH,
+                          num_workers=event_queue.DEFAULT_NUM_WORKERS):
+  """
+  Switch EventsHandler.POST to write-behind mode: submissions are validated
+  and queued, and applied to the adaptive model by background workers.
+  Queues in memory, or in a journal under journal_dir if one is given.
+  Importing data_api does not call this: the server that serves data_api.app
+  calls it once per process, before serving requests. Until then, events are
+  applied synchronously.
+  """
+  global event_processor
+  if journal_dir:
+    queue = event_queue.FileEventQueue(journal_dir, max_depth)
+  else:
+    queue = event_queue.MemoryEventQueue(max_depth)
+  event_processor = event_queue.EventProcessor(
+      queue, apply_queued_events, num_workers)
+  event_processor.start()
+  return event_processor
+
+
 class EventsHandler(OpenMindsAPIHandler):
+  @instrument
   @add_cors_headers
   @public_api_auth
   def POST(self, auth_user=None, auth_app_id=None):
@@ -1352,7 +2429,6 @@ class EventsHandler(OpenMindsAPIHandler):
 
     events_json = data['events']
 
-    new_points = 0
     events = []
     for event_json in events_json:
       try:
@@ -1363,69 +2439,71 @@ class EventsHandler(OpenMindsAPIHandler):
         event_json['timestamp'] = datetime.fromtimestamp(event_json['timestamp'])
         event = Event(event_json)
         event.set_user(log_user)
-        event.save()
         events.append(event)
       except ValidationError, e:
         logging.warn(e)
         return error_response(400, e.error)
 
-    for event in events:
-      if event.outcome is True:
-        new_points = new_points + 10
-
+    if event_processor is not None:
+      # Write-behind mode: the events are applied by the event processor.
       try:
-        item_info = adaptive_model.update_user_item_info(log_user, event)
-        item_info.save()
-
-        if list_id is not None:
-          list_info = adaptive_model.update_user_list_info(
-              log_user, list_id, event)
-          list_info.save()
-
+        event_processor.submit({
+          'userId': log_user._id,
+          'listId': list_id,
+          'appId': auth_app_id,
+          'timestamp': data['timestamp'],
+          'events': events_json,
+        })
+        return encode_json({'success': True, 'queued': True})
+      except event_queue.QueueFull:
+        logging.warn('Event queue is full')
+        web.header('Retry-After', str(EVENT_QUEUE_RETRY_AFTER_SECONDS))
+        return error_response(503, 'Event queue is full')
+      except event_queue.ProcessorStopped:
+        # Apply the events here rather than queue them for nobody.
+        logging.error('Event processor is not running')
       except Exception, e:
         logging.error(e)
-        return error_response(500, 'Could not log events')
-
-    log_user.points = log_user.get('points', 0) + new_points
+        return error_response(500, 'Could not queue events')
 
     try:
-      self.add_sampling_records(log_user._id, list_id, auth_app_id, data['timestamp'],
-                                events)
+      record_event_batches(log_user, [{
+        'listId': list_id,
+        'appId': auth_app_id,
+        'timestamp': data['timestamp'],
+        'events': events,
+      }])
     except Exception, e:
       logging.error(e)
-      return error_response(500, 'Could not log sampling record.')
-
-    try:
-      log_user.save()
-    except Exception, e:
-      logging.error(e)
-      return error_response(500, 'Could not save user')
+      return error_response(500, 'Could not log events')
 
     return encode_json({'success': True})
 
-  def add_sampling_records(self, user_id, list_id, app_id, timestamp, events):
-    """
-    These events represent a 'sampling' of activities on the given list
-    across one or more apps.
-    We want to record a summary of this sampling: at this time user
-    was tested on this list and got this percent right.
-    """
-    outcomes = []
-    for event in events:
-      # We are not going to be searching over these itemIds in the
-      # database, feels a bit saner to store them as strings.
-      outcome = {
-        'itemId': str(event.itemId),
-        'outcome': adaptive_model.event_outcome_is_positive(event),
-      }
-      outcomes.append(outcome)
-    sampling_record = adaptive_model.create_sampling_record(user_id, list_id,
-                                                            app_id, timestamp,
-                                                            outcomes)
-    sampling_record.save()
+
+class EventQueueHandler(OpenMindsAPIHandler):
+  @instrument
+  @add_cors_headers
+  @private_api_auth
+  def GET(self, auth_user=None, auth_app_id=None):
+    '''Report the state of the write-behind event queue.'''
+    if event_processor is None:
+      return encode_json({'enabled': False})
+    stats = event_processor.stats()
+    stats['enabled'] = True
+    return encode_json(stats)
+
+
+class MetricsHandler(OpenMindsAPIHandler):
+  @instrument
+  @add_cors_headers
+  @private_api_auth
+  def GET(self, auth_user=None, auth_app_id=None):
+    '''Report the per-handler request metrics of this server process.'''
+    return encode_json(metrics.snapshot())
 
 
 class CommonCoreHandler(object):
+  @instrument
   def GET(self, grade):
     grade = parse_int_param(grade, 5)
     common_core = CommonCore()
@@ -1444,6 +2522,7 @@ class CommonCoreHandler(object):
 
 
 class LittleLivesAuthenticateHandler(object):
+  @instrument
   @private_api_auth
   def GET(self, auth_user=None, auth_app_id=None):
     params = web.input(username=None, password=None)
@@ -1488,6 +2567,7 @@ class LittleLivesAuthenticateHandler(object):
 
 
 class LittleLivesUsersHandler(object):
+  @instrument
   @private_api_auth
   def GET(self, auth_user=None, auth_app_id=None):
     client = littlelives_info.get_client();
@@ -0,0 +1,312 @@
+'''
+Write-behind queue for event submissions.
+
+In write-behind mode EventsHandler.POST validates a submission, appends it
+to an EventQueue and returns; an EventProcessor drains the queue in the
+background and applies the events to the adaptive model. Game clients then
+wait for a queue append instead of the stats recomputation.
+
+The drained records are grouped by user only. Each user's records are
+passed to apply_fn together, in queue order, and any batching of their
+writes is up to apply_fn; nothing here merges records per item.
+
+Two queues are provided:
+- MemoryEventQueue: in-process and bounded. Queued events are lost if the
+  process dies.
+- FileEventQueue: an append-only journal on local disk. Records are synced
+  to disk before put() returns, and only committed once they have been
+  applied, so a restarted processor picks up where it left off. Records
+  may be applied twice after a crash.
+
+Both raise QueueFull once max_depth records are waiting, which the
+handler turns into a 503 so that clients back off.
+
+Applying events is not idempotent (events are inserted, points and outcome
+counts incremented), so records that fail to apply are not retried: they
+are dead-lettered instead. The memory queue logs them; the file queue also
+appends them to events.dead next to its journal, along with any journal
+line that cannot be decoded, for inspection and replay by hand.
+
+Nothing starts a processor on import: the server that serves data_api.app
+calls data_api.start_event_processor() at startup to enable write-behind
+mode.
+'''
+
+from bson import json_util
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+import Queue
+import logging
+import os
+import threading
+import time
+
+DEFAULT_MAX_DEPTH = 10000
+DEFAULT_NUM_WORKERS = 4
+# Most records drained from the queue and applied in one go.
+MAX_DRAIN = 500
+# Pause after an unexpected error in the processor loop.
+ERROR_DELAY_SECONDS = 1
+
+
+class QueueFull(Exception):
+  pass
+
+
+class ProcessorStopped(Exception):
+  pass
+
+
+class MemoryEventQueue(object):
+  '''
+  Bounded in-process queue. get() returns (record, token); pass the token of
+  the last record handled to commit().
+  '''
+  def __init__(self, max_depth=DEFAULT_MAX_DEPTH):
+    self._queue = Queue.Queue(max_depth)
+
+  def put(self, record):
+    try:
+      self._queue.put_nowait(record)
+    except Queue.Full:
+      raise QueueFull()
+
+  def get(self, timeout=None):
+    try:
+      return self._queue.get(timeout=timeout), None
+    except Queue.Empty:
+      return None, None
+
+  def commit(self, token):
+    pass
+
+  def dead_letter(self, records):
+    logging.error('Dead-lettered queued event records: %s' %
+                  json_util.dumps(records))
+
+  def depth(self):
+    return self._queue.qsize()
+
+
+class FileEventQueue(object):
+  '''
+  Durable queue backed by a journal of JSON lines in `directory`. The
+  journal is read by a single consumer; the byte offset of the last
+  committed record is kept next to it. Once everything has been consumed
+  the journal is truncated.
+  '''
+  def __init__(self, directory, max_depth=DEFAULT_MAX_DEPTH):
+    if not os.path.isdir(directory):
+      os.makedirs(directory)
+    self.max_depth = max_depth
+    self._journal_path = os.path.join(directory, 'events.journal')
+    self._offset_path = os.path.join(directory, 'events.offset')
+    self._dead_path = os.path.join(directory, 'events.dead')
+    self._lock = threading.Condition()
+    self._writer = open(self._journal_path, 'ab')
+    self._reader = open(self._journal_path, 'rb')
+    self._committed = self._read_offset()
+    self._reader.seek(self._committed)
+    # Records appended but not yet committed.
+    self._depth = self._count_lines(
+        self._committed, os.path.getsize(self._journal_path))
+
+  def _read_offset(self):
+    try:
+      with open(self._offset_path, 'rb') as f:
+        return int(f.read().strip() or 0)
+    except IOError:
+      return 0
+
+  def _write_offset(self, offset):
+    temp_path = self._offset_path + '.tmp'
+    with open(temp_path, 'wb') as f:
+      f.write(str(offset))
+      f.flush()
+      os.fsync(f.fileno())
+    os.rename(temp_path, self._offset_path)
+
+  def put(self, record):
+    line = json_util.dumps(record) + '\n'
+    with self._lock:
+      if self._depth >= self.max_depth:
+        raise QueueFull()
+      self._writer.write(line)
+      self._writer.flush()
+      os.fsync(self._writer.fileno())
+      self._depth += 1
+      self._lock.notify()
+
+  def get(self, timeout=None):
+    '''
+    Returns (record, token), or (None, None) if nothing arrived within
+    timeout seconds.
+    '''
+    deadline = None if timeout is None else time.time() + timeout
+    with self._lock:
+      while True:
+        position = self._reader.tell()
+        line = self._reader.readline()
+        if line.endswith('\n'):
+          try:
+            return json_util.loads(line), self._reader.tell()
+          except ValueError, e:
+            # Skip it; it is committed along with the next record.
+            logging.error('Corrupt event journal line at %d: %s' %
+                          (position, e))
+            self._append_dead(line)
+            continue
+        # Nothing complete to read yet.
+        self._reader.seek(position)
+        remaining = None if deadline is None else deadline - time.time()
+        if remaining is not None and remaining <= 0:
+          return None, None
+        self._lock.wait(remaining)
+
+  def commit(self, token):
+    '''
+    Marks every record up to the one returned with token as applied.
+    '''
+    with self._lock:
+      consumed = self._count_lines(self._committed, token)
+      self._depth -= consumed
+      if self._depth == 0 and token == self._reader.tell():
+        # Everything has been applied: start a fresh journal. The reader is
+        # reopened because a seek alone can leave stale data in its buffer.
+        self._writer.truncate(0)
+        self._writer.seek(0)
+        self._reader.close()
+        self._reader = open(self._journal_path, 'rb')
+        token = 0
+      self._committed = token
+      self._write_offset(token)
+
+  def dead_letter(self, records):
+    logging.error('Dead-lettered %d queued event records' % len(records))
+    self._append_dead(
+        ''.join(json_util.dumps(record) + '\n' for record in records))
+
+  def _append_dead(self, lines):
+    with open(self._dead_path, 'ab') as f:
+      f.write(lines)
+      f.flush()
+      os.fsync(f.fileno())
+
+  def _count_lines(self, start, end):
+    if end <= start:
+      return 0
+    with open(self._journal_path, 'rb') as f:
+      f.seek(start)
+      return f.read(end - start).count('\n')
+
+  def depth(self):
+    with self._lock:
+      return self._depth
+
+
+class EventProcessor(object):
+  '''
+  Drains an event queue on a background thread. Each drained run of records
+  is grouped by user, not by item, and handed to apply_fn(user_id, records)
+  on a pool of worker threads, so that one user's records are applied
+  together and in order. The queue is committed once the whole run has been applied. A
+  group that fails is dead-lettered, and errors never stop the processor
+  thread; if it has stopped anyway, submit() raises ProcessorStopped.
+  '''
+  def __init__(self, queue, apply_fn, num_workers=DEFAULT_NUM_WORKERS):
+    self.queue = queue
+    self.apply_fn = apply_fn
+    self.num_workers = num_workers
+    self.processed = 0
+    self.failed = 0
+    self._workers = ThreadPool(num_workers)
+    self._stopped = threading.Event()
+    self._thread = threading.Thread(target=self._run, name='EventProcessor')
+    self._thread.daemon = True
+
+  def start(self):
+    self._thread.start()
+
+  def stop(self, timeout=None):
+    self._stopped.set()
+    self._thread.join(timeout)
+    self._workers.close()
+    self._workers.join()
+
+  def submit(self, record):
+    '''
+    Queues a record, raising QueueFull if the queue is at capacity and
+    ProcessorStopped if no thread is draining it.
+    '''
+    if not self._thread.is_alive():
+      raise ProcessorStopped()
+    self.queue.put(record)
+
+  def stats(self):
+    return {
+      'queueDepth': self.queue.depth(),
+      'processed': self.processed,
+      'failed': self.failed,
+    }
+
+  def _drain(self):
+    record, token = self.queue.get(timeout=1)
+    if record is None:
+      return [], None
+    records = [record]
+    while len(records) < MAX_DRAIN:
+      next_record, next_token = self.queue.get(timeout=0)
+      if next_record is None:
+        break
+      records.append(next_record)
+      token = next_token
+    return records, token
+
+  def _run(self):
+    while not self._stopped.is_set():
+      try:
+        self._process()
+      except Exception, e:
+        logging.error('Event processor error: %s' % e)
+        time.sleep(ERROR_DELAY_SECONDS)
+
+  def _process(self):
+    records, token = self._drain()
+    if not records:
+      return
+
+    records_by_user = OrderedDict()
+    for record in records:
+      try:
+        records_by_user.setdefault(record['userId'], []).append(record)
+      except Exception, e:
+        logging.error('Not a valid queued event record: %s' % e)
+        self._dead_letter([record])
+
+    pending = [
+        (user_id, user_records,
+         self._workers.apply_async(self._apply, (user_id, user_records)))
+        for user_id, user_records in records_by_user.iteritems()]
+    for user_id, user_records, result in pending:
+      if result.get():
+        self.processed += len(user_records)
+      else:
+        self._dead_letter(user_records)
+    self.queue.commit(token)
+
+  def _apply(self, user_id, records):
+    try:
+      self.apply_fn(user_id, records)
+      return True
+    except Exception, e:
+      logging.error('Could not apply %d queued event records for user %s: '
+                    '%s' % (len(records), user_id, e))
+      return False
+
+  def _dead_letter(self, records):
+    self.failed += len(records)
+    try:
+      self.queue.dead_letter(records)
+    except Exception, e:
+      logging.error('Could not dead-letter %d queued event records: %s' %
+                    (len(records), e))
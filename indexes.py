@@ -0,0 +1,110 @@
+'''
+Mongo index provisioning, and a coverage check for the handlers' queries.
+
+data_api and stats_api declare the indexes their queries need (INDEXES),
+and the shapes of the queries themselves (QUERY_SHAPES), next to the
+handlers. ensure_indexes() creates the indexes; it can be run any number
+of times, since Mongo ignores an index that already exists.
+find_collection_scans() runs explain() on every query shape and returns
+the ones that would scan a whole collection.
+
+Usage: python indexes.py          create the declared indexes
+       python indexes.py --check  report query shapes that scan a
+                                  collection; exits 1 if there are any
+'''
+
+import logging
+import sys
+
+
+class Index(object):
+  '''
+  An index on document_class' collection. keys is a list of (field,
+  direction) pairs; options are passed to create_index (unique, sparse...).
+  '''
+  def __init__(self, document_class, keys, **options):
+    self.document_class = document_class
+    self.keys = keys
+    self.options = options
+
+  def __str__(self):
+    return '%s %s' % (self.document_class.__name__, self.keys)
+
+
+class QueryShape(object):
+  '''
+  A query issued by a handler, with representative values: the checker only
+  looks at the plan, so the values need not match any document.
+  '''
+  def __init__(self, name, document_class, spec, sort=None):
+    self.name = name
+    self.document_class = document_class
+    self.spec = spec
+    self.sort = sort
+
+  def explain(self):
+    cursor = self.document_class.collection.find(self.spec)
+    if self.sort:
+      cursor = cursor.sort(self.sort)
+    return cursor.explain()
+
+
+def ensure_indexes(indexes):
+  for index in indexes:
+    logging.info('Ensuring index %s' % index)
+    index.document_class.collection.create_index(index.keys, **index.options)
+
+
+def uses_collection_scan(explanation):
+  '''
+  True if an explain() result describes a collection scan. Mongo 3.0 and up
+  report a tree of plan stages; older servers name the cursor type.
+  '''
+  if explanation.get('cursor', '').startswith('BasicCursor'):
+    return True
+  query_planner = explanation.get('queryPlanner')
+  if query_planner is None:
+    return False
+  stages = [query_planner.get('winningPlan', {})]
+  while stages:
+    stage = stages.pop()
+    if stage.get('stage') == 'COLLSCAN':
+      return True
+    if 'inputStage' in stage:
+      stages.append(stage['inputStage'])
+    stages.extend(stage.get('inputStages', []))
+  return False
+
+
+def find_collection_scans(query_shapes):
+  '''
+  Returns the query shapes whose winning plan scans a whole collection.
+  '''
+  return [shape for shape in query_shapes
+          if uses_collection_scan(shape.explain())]
+
+
+def main(argv):
+  import data_api
+  import stats_api
+  indexes = data_api.INDEXES + stats_api.INDEXES
+  query_shapes = data_api.QUERY_SHAPES + stats_api.QUERY_SHAPES
+
+  if '--check' not in argv:
+    ensure_indexes(indexes)
+    print 'Ensured %d indexes' % len(indexes)
+    return 0
+
+  scans = find_collection_scans(query_shapes)
+  for shape in scans:
+    print 'Collection scan: %s (%s %s)' % (
+        shape.name, shape.document_class.__name__, shape.spec)
+  print '%d of %d query shapes scan a collection' % (
+      len(scans), len(query_shapes))
+  if scans:
+    return 1
+  return 0
+
+
+if __name__ == '__main__':
+  sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,185 @@
+'''
+Materialized points leaderboards: one global board, and one per teacher for
+the class-only view.
+
+LeaderboardHandler.GET used to sort the whole User collection by points on
+every request, and the class-only view filters on an acl.<teacher id> key
+that no index can serve. Each board here keeps the top MAX_ENTRIES users
+sorted by points. A board is loaded with one query when it is first read,
+and EventsHandler then pushes point changes into every loaded board the
+user appears on, so a read only copies out the entries it returns.
+
+Like the adaptive order cache, the boards live in each server process and
+miss point changes made by other processes, so they are reloaded after
+MAX_AGE_SECONDS. A teacher's board is reloaded after TEACHER_MAX_AGE_SECONDS
+instead: its load is the unindexed acl.<teacher id> query, and every point
+change of this process still reaches it, new students included, since the
+pushed user data carries the acl. clear() drops them all so they are
+rebuilt from scratch.
+
+Loads run outside the cache lock, so a slow one does not hold up the other
+boards. Point changes pushed while a board loads are replayed on it before
+it is swapped in, and a board that is being reloaded keeps serving reads
+that it can answer.
+'''
+
+import bisect
+import threading
+import time
+
+MAX_ENTRIES = 100
+MAX_AGE_SECONDS = 60
+TEACHER_MAX_AGE_SECONDS = 600
+
+# User fields kept for each leaderboard entry.
+ENTRY_FIELDS = ('username', 'name', 'points')
+
+
+class Leaderboard(object):
+  '''
+  The users with the most points, best first, up to max_entries of them.
+  Entries are user data dicts with _id and ENTRY_FIELDS.
+  '''
+  def __init__(self, max_entries=MAX_ENTRIES):
+    self.max_entries = max_entries
+    self.created = time.time()
+    # Sorted (-points, user id) pairs.
+    self._ranking = []
+    # user id -> entry.
+    self._entries = {}
+    # True while the board holds every user that qualifies, in which case
+    # any user can be added. Otherwise only users who beat the last entry
+    # can be, since users below it are not known.
+    self._exhaustive = True
+
+  def load(self, users_data):
+    '''
+    Fills the board from user data sorted by points, best first.
+    '''
+    num_loaded = 0
+    for user_data in users_data:
+      self.update(user_data)
+      num_loaded += 1
+    self._exhaustive = num_loaded < self.max_entries
+
+  def update(self, user_data):
+    '''
+    Records a user's new points.
+    '''
+    user_id = str(user_data['_id'])
+    self._remove(user_id)
+    rank_key = (-user_data.get('points', 0), user_id)
+    if not self._exhaustive and (
+        not self._ranking or rank_key > self._ranking[-1]):
+      # The user may be beaten by users the board does not know about.
+      return
+
+    bisect.insort(self._ranking, rank_key)
+    self._entries[user_id] = dict(
+        (field, user_data.get(field)) for field in ('_id',) + ENTRY_FIELDS)
+    if len(self._ranking) > self.max_entries:
+      dropped_points, dropped_id = self._ranking.pop()
+      del self._entries[dropped_id]
+      self._exhaustive = False
+
+  def remove(self, user_id):
+    self._remove(str(user_id))
+
+  def _remove(self, user_id):
+    entry = self._entries.pop(user_id, None)
+    if entry is None:
+      return False
+    index = bisect.bisect_left(
+        self._ranking, (-entry.get('points', 0), user_id))
+    del self._ranking[index]
+    return True
+
+  def can_serve(self, num_entries):
+    return self._exhaustive or num_entries <= len(self._ranking)
+
+  def top(self, num_entries):
+    return [dict(self._entries[user_id])
+            for points, user_id in self._ranking[:num_entries]]
+
+
+class LeaderboardCache(object):
+  '''
+  The global leaderboard (key None) and per teacher leaderboards (keyed by
+  teacher id), loaded on first read.
+  '''
+  def __init__(self, max_entries=MAX_ENTRIES, max_age=MAX_AGE_SECONDS,
+               teacher_max_age=TEACHER_MAX_AGE_SECONDS):
+    self.max_entries = max_entries
+    self.max_age = max_age
+    self.teacher_max_age = teacher_max_age
+    self._boards = {}
+    # key -> [number of loads in progress, user data pushed meanwhile].
+    self._loading = {}
+    self._lock = threading.Lock()
+
+  def top(self, key, num_entries, load_fn):
+    '''
+    Returns the top num_entries entries of the board for key. If the board
+    is not loaded, is too old or too short, load_fn(limit) is called for
+    user data sorted by points to rebuild it.
+    '''
+    key = key and str(key)
+    max_age = self.max_age if key is None else self.teacher_max_age
+    with self._lock:
+      board = self._boards.get(key)
+      can_serve = board is not None and board.can_serve(num_entries)
+      if can_serve and time.time() - board.created <= max_age:
+        return board.top(num_entries)
+      if can_serve and key in self._loading:
+        # Another request is already reloading this board.
+        return board.top(num_entries)
+      loading = self._loading.setdefault(key, [0, []])
+      loading[0] += 1
+
+    try:
+      new_board = Leaderboard(max(self.max_entries, num_entries))
+      new_board.load(load_fn(new_board.max_entries))
+    except:
+      with self._lock:
+        self._end_load(key, loading)
+      raise
+
+    with self._lock:
+      self._end_load(key, loading)
+      for user_data in loading[1]:
+        self._apply(new_board, user_data)
+      self._boards[key] = new_board
+      return new_board.top(num_entries)
+
+  def update_user(self, user_data):
+    '''
+    Pushes a user's new points into the global board and the boards of the
+    user's teachers. user_data needs _id, ENTRY_FIELDS, acl and flagged.
+    '''
+    keys = [None] + [str(teacher_id)
+                     for teacher_id in user_data.get('acl', {}).keys()]
+    with self._lock:
+      for key in keys:
+        if key in self._loading:
+          self._loading[key][1].append(user_data)
+        board = self._boards.get(key)
+        if board is not None:
+          self._apply(board, user_data)
+
+  def _end_load(self, key, loading):
+    loading[0] -= 1
+    if not loading[0]:
+      del self._loading[key]
+
+  def _apply(self, board, user_data):
+    if user_data.get('flagged'):
+      board.remove(user_data['_id'])
+    else:
+      board.update(user_data)
+
+  def clear(self):
+    with self._lock:
+      self._boards.clear()
+
+
+leaderboards = LeaderboardCache()
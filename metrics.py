@@ -0,0 +1,181 @@
+'''
+Per-handler request metrics for data_api and stats_api.
+
+Handler methods decorated with @instrument (outermost, above
+@add_cors_headers) record, per handler class and HTTP method:
+- wall time;
+- the number of Mongo operations issued;
+- the bytes produced by encode_json;
+- the size of the response.
+
+snapshot() returns the totals and latency percentiles so far. Requests
+that are slower than SLOW_REQUEST_SECONDS, or that issue more than
+SLOW_REQUEST_MONGO_OPS operations (the usual sign of an N+1 pattern), are
+logged as warnings.
+
+Mongo operations are counted with pymongo's command monitoring (pymongo
+3.1 and up). The listener only sees connections opened after this module
+is imported, so it has to be imported before the backend connects; without
+monitoring, the Mongo counts are reported as None.
+'''
+
+from collections import deque
+from libraries.python import web_util
+import logging
+import threading
+import time
+import web
+
+try:
+  from pymongo import monitoring
+except ImportError:
+  monitoring = None
+
+SLOW_REQUEST_SECONDS = 1.0
+SLOW_REQUEST_MONGO_OPS = 50
+# Latest wall times kept per handler for the percentiles.
+MAX_SAMPLES = 1000
+
+# Counters of the request being handled on this thread.
+_request = threading.local()
+
+
+class HandlerMetrics(object):
+  def __init__(self):
+    self.count = 0
+    self.errors = 0
+    self.seconds = 0.0
+    self.max_seconds = 0.0
+    self.mongo_ops = 0
+    self.max_mongo_ops = 0
+    self.json_bytes = 0
+    self.response_bytes = 0
+    self.samples = deque(maxlen=MAX_SAMPLES)
+
+  def record(self, seconds, failed, mongo_ops, json_bytes, response_bytes):
+    self.count += 1
+    if failed:
+      self.errors += 1
+    self.seconds += seconds
+    self.max_seconds = max(self.max_seconds, seconds)
+    if mongo_ops is not None:
+      self.mongo_ops += mongo_ops
+      self.max_mongo_ops = max(self.max_mongo_ops, mongo_ops)
+    self.json_bytes += json_bytes
+    self.response_bytes += response_bytes
+    self.samples.append(seconds)
+
+  def snapshot(self):
+    samples = sorted(self.samples)
+    snapshot = {
+      'count': self.count,
+      'errors': self.errors,
+      'meanMs': 1000 * self.seconds / self.count,
+      'p50Ms': 1000 * percentile(samples, 0.5),
+      'p95Ms': 1000 * percentile(samples, 0.95),
+      'maxMs': 1000 * self.max_seconds,
+      'jsonBytes': self.json_bytes,
+      'responseBytes': self.response_bytes,
+      'meanMongoOps': None,
+      'maxMongoOps': None,
+    }
+    if monitoring is not None:
+      snapshot['meanMongoOps'] = float(self.mongo_ops) / self.count
+      snapshot['maxMongoOps'] = self.max_mongo_ops
+    return snapshot
+
+
+def percentile(sorted_values, fraction):
+  if not sorted_values:
+    return 0.0
+  index = min(len(sorted_values) - 1, int(len(sorted_values) * fraction))
+  return sorted_values[index]
+
+
+_metrics = {}
+_metrics_lock = threading.Lock()
+
+
+def snapshot():
+  '''
+  Returns {'<Handler>.<METHOD>': {...}} for every handler called so far.
+  '''
+  with _metrics_lock:
+    return dict((name, handler_metrics.snapshot())
+                for name, handler_metrics in _metrics.iteritems())
+
+
+def reset():
+  with _metrics_lock:
+    _metrics.clear()
+
+
+if monitoring is not None:
+  class MongoOpCounter(monitoring.CommandListener):
+    def started(self, event):
+      if getattr(_request, 'active', False):
+        _request.mongo_ops += 1
+
+    def succeeded(self, event):
+      pass
+
+    def failed(self, event):
+      pass
+
+  monitoring.register(MongoOpCounter())
+
+
+def encode_json(data):
+  '''
+  web_util.encode_json, counting the bytes encoded for the current request.
+  '''
+  encoded = web_util.encode_json(data)
+  if getattr(_request, 'active', False):
+    _request.json_bytes += len(encoded)
+  return encoded
+
+
+def instrument(method):
+  '''
+  Decorator for handler methods that records their metrics.
+  '''
+  def instrumented(self, *args, **kwargs):
+    if getattr(_request, 'active', False):
+      # Called from another instrumented method; that one is recording.
+      return method(self, *args, **kwargs)
+
+    _request.active = True
+    _request.mongo_ops = 0
+    _request.json_bytes = 0
+    response = None
+    failed = True
+    start = time.time()
+    try:
+      response = method(self, *args, **kwargs)
+      failed = web.ctx.get('status', '200')[:1] not in ('2', '3')
+      return response
+    finally:
+      seconds = time.time() - start
+      _request.active = False
+      name = '%s.%s' % (type(self).__name__, web.ctx.get('method'))
+      mongo_ops = _request.mongo_ops if monitoring is not None else None
+      if isinstance(response, basestring):
+        response_bytes = len(response)
+      else:
+        response_bytes = 0
+      with _metrics_lock:
+        handler_metrics = _metrics.get(name)
+        if handler_metrics is None:
+          handler_metrics = _metrics[name] = HandlerMetrics()
+        handler_metrics.record(seconds, failed, mongo_ops,
+                               _request.json_bytes, response_bytes)
+      if (seconds >= SLOW_REQUEST_SECONDS or
+          (mongo_ops is not None and mongo_ops >= SLOW_REQUEST_MONGO_OPS)):
+        logging.warn('Slow request %s %s: %.0f ms, %s Mongo ops, %d JSON '
+                     'bytes, %d response bytes' %
+                     (name, web.ctx.get('path'), seconds * 1000, mongo_ops,
+                      _request.json_bytes, response_bytes))
+
+  instrumented.__name__ = method.__name__
+  instrumented.__doc__ = method.__doc__
+  return instrumented
@@ -10,7 +10,7 @@ import oauth2
 import os
 import re
 import time
-import httplib
+from connection_pool import get_pool
 import sys
 import csv
 from libraries.python.web_util import encode_json, decode_json
@@ -30,19 +30,20 @@ logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=lo
 class AbstractOpenMindsClient(object):
   '''
   Abstract OpenMindsClient class. Subclasses should implement the _api_response()
-  method, which should return the response from an HTTPConnection object.
+  method, which should return a response object with a read() method.
   '''
 
-  def __init__(self, host=None):
+  def __init__(self, host=None, pool_size=None):
     if host:
       self.host = host
     else:
       self.host = DEFAULT_HOST
+    self.pool = get_pool(self.host, pool_size)
     
   def _api_response(self, method, path, body={}):
     '''
     Implemented by subclasses. Should return a response
-    from an HTTPConnection object.
+    from the client's connection pool.
     '''
     return None
 
@@ -98,6 +99,9 @@ class AbstractOpenMindsClient(object):
   def create_item(self, list_id, info):
     return self._get_json('POST', '/api/data/lists/%s/' % list_id, info)
 
+  def create_items(self, list_id, infos):
+    return self._get_json('POST', '/api/data/lists/%s/' % list_id, infos)
+
   def get_assignment(self, assignment_id):
     return self._get_json('GET', '/api/data/assignments/%s/' % (assignment_id))
 
@@ -131,8 +135,8 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
   user provides an API key and API secret, which are used to securely sign the
   request.
   '''
-  def __init__(self, key, secret, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, key, secret, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.key = key
     self.secret = secret
 
@@ -162,13 +166,10 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
     req = self._get_request(method, path, str_body, extra_params=params)
     data = req.to_postdata()
 
-    connection = httplib.HTTPConnection(self.host)
     if self.host.startswith('localhost') and method == 'POST':
       # Workaround for sending api POST requests to local server.
-      connection.request(method, path, data)
-    else:
-      connection.request(method, path + '?' + data, str_body)
-    return connection.getresponse()
+      return self.pool.request(method, path, data)
+    return self.pool.request(method, path + '?' + data, str_body)
 
   def get_game_url(self, game_id, list_id, params):
     path = '/game/%s/%s/' % (game_id, list_id)
@@ -183,15 +184,14 @@ class OpenMindsThreeLeggedClient(AbstractOpenMindsClient):
   an app access through the web interface. The access token is used by the app
   to get access to the API on behalf of the user.
   '''
-  def __init__(self, access_token, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, access_token, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.access_token = access_token
 
   def _api_response(self, method, path, body=None):
     '''
     Includes the access token as a header in the request.
     '''
-    connection = httplib.HTTPConnection(self.host)
     if body:
       data = encode_json(body)
     else:
@@ -202,10 +202,8 @@ class OpenMindsThreeLeggedClient(AbstractOpenMindsClient):
     if method == 'GET':
       if data:
         path += '?' + data
-      connection.request(method, path, None, headers)
-    else:
-      connection.request(method, path, data, headers)
-    return connection.getresponse()
+      return self.pool.request(method, path, None, headers)
+    return self.pool.request(method, path, data, headers)
 
 
 def   count_number_of_occurrences(reg,textlist):
@@ -242,25 +240,17 @@ def create_OMList_from_file(fname):
 
     idictsList = create_item_dicts(textlist, listType, two_lines=False) #om_utils
 
-    # create a new list
+    # create the list together with its items, in one request
     print ld
-    newList =  client.create_list(ld) # the actual list shell creation
+    newList, results = create_list_with_items(client, ld, idictsList) # om_utils
 
     # test for "error"
     if isResponseErrorFree(newList)!=1:
         return []
 
-    # double checking
-    try:
-        lid= newList["id"]
-    except ValueError, e:
-        logging.warning("new List ID is incorrect. Aborting this file %s \n" % fname)
-
-    # create new items
-    for iteminfo in idictsList:
-        logging.info(iteminfo)
-        it = client.create_item(lid,iteminfo)
-        isResponseErrorFree(it) # will print if there is error
+    for r in results:
+        if r["error"]:
+            logging.warning("Item not created: %s %s" % (r["info"], r["error"]))
 
     return newList
 
@@ -271,10 +261,11 @@ if __name__ == '__main__':
 
   argv = cfg.FLAGS(sys.argv)
   print argv
+  pool_size = cfg.FLAGS.om_pool_size
   if cfg.FLAGS.om_access_token:
-    client = OpenMindsThreeLeggedClient(cfg.FLAGS.om_access_token, cfg.FLAGS.om_host)
+    client = OpenMindsThreeLeggedClient(cfg.FLAGS.om_access_token, cfg.FLAGS.om_host, pool_size)
   else:
-    client = OpenMindsTwoLeggedClient(cfg.FLAGS.om_key, cfg.FLAGS.om_secret, cfg.FLAGS.om_host)
+    client = OpenMindsTwoLeggedClient(cfg.FLAGS.om_key, cfg.FLAGS.om_secret, cfg.FLAGS.om_host, pool_size)
   
   logging.info("Me: %s" % client.get_user('me'))
 
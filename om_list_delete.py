@@ -8,7 +8,7 @@ Adapted from Adam's version by Ram Narasimhan
 import gflags
 import oauth2
 import time
-import httplib
+from connection_pool import get_pool
 import sys
 import csv
 from libraries.python.web_util import encode_json, decode_json
@@ -21,19 +21,20 @@ import cfg
 class AbstractOpenMindsClient(object):
   '''
   Abstract OpenMindsClient class. Subclasses should implement the _api_response()
-  method, which should return the response from an HTTPConnection object.
+  method, which should return a response object with a read() method.
   '''
 
-  def __init__(self, host=None):
+  def __init__(self, host=None, pool_size=None):
     if host:
       self.host = host
     else:
       self.host = DEFAULT_HOST
+    self.pool = get_pool(self.host, pool_size)
     
   def _api_response(self, method, path, body={}):
     '''
     Implemented by subclasses. Should return a response
-    from an HTTPConnection object.
+    from the client's connection pool.
     '''
     return None
 
@@ -78,6 +79,9 @@ class AbstractOpenMindsClient(object):
   def delete_list(self, list_id):
     return self._get_json('DELETE', '/api/data/lists/%s/' % list_id)
 
+  def delete_lists(self, params):
+    return self._get_json('DELETE', '/api/data/lists/', params=params)
+
 
 
   def get_item(self, list_id, item_id):
@@ -122,8 +126,8 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
   user provides an API key and API secret, which are used to securely sign the
   request.
   '''
-  def __init__(self, key, secret, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, key, secret, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.key = key
     self.secret = secret
 
@@ -153,13 +157,10 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
     req = self._get_request(method, path, str_body, extra_params=params)
     data = req.to_postdata()
 
-    connection = httplib.HTTPConnection(self.host)
     if self.host.startswith('localhost') and method == 'POST':
       # Workaround for sending api POST requests to local server.
-      connection.request(method, path, data)
-    else:
-      connection.request(method, path + '?' + data, str_body)
-    return connection.getresponse()
+      return self.pool.request(method, path, data)
+    return self.pool.request(method, path + '?' + data, str_body)
 
   def get_game_url(self, game_id, list_id, params):
     path = '/game/%s/%s/' % (game_id, list_id)
@@ -174,15 +175,14 @@ class OpenMindsThreeLeggedClient(AbstractOpenMindsClient):
   an app access through the web interface. The access token is used by the app
   to get access to the API on behalf of the user.
   '''
-  def __init__(self, access_token, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, access_token, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.access_token = access_token
 
   def _api_response(self, method, path, body=None):
     '''
     Includes the access token as a header in the request.
     '''
-    connection = httplib.HTTPConnection(self.host)
     if body:
       data = encode_json(body)
     else:
@@ -193,10 +193,8 @@ class OpenMindsThreeLeggedClient(AbstractOpenMindsClient):
     if method == 'GET':
       if data:
         path += '?' + data
-      connection.request(method, path, None, headers)
-    else:
-      connection.request(method, path, data, headers)
-    return connection.getresponse()
+      return self.pool.request(method, path, None, headers)
+    return self.pool.request(method, path, data, headers)
 
 
 
@@ -209,25 +207,22 @@ if __name__ == '__main__':
   argv = cfg.FLAGS(sys.argv)
   print argv
   if cfg.FLAGS.om_access_token:
-    client = OpenMindsThreeLeggedClient(cfg.FLAGS.om_access_token, cfg.FLAGS.om_host)
+    client = OpenMindsThreeLeggedClient(cfg.FLAGS.om_access_token, cfg.FLAGS.om_host, cfg.FLAGS.om_pool_size)
   else:
-    client = OpenMindsTwoLeggedClient(cfg.FLAGS.om_key, cfg.FLAGS.om_secret, cfg.FLAGS.om_host)
+    client = OpenMindsTwoLeggedClient(cfg.FLAGS.om_key, cfg.FLAGS.om_secret, cfg.FLAGS.om_host, cfg.FLAGS.om_pool_size)
 
   print client.get_user('me')
 
 
-# step 1 get all lists created by this user "me"
-  myLists =  client.get_lists({"search":"created"})
-
-
+# step 1 ask the server how many of my lists match
   NUMITEMS_IN_LIST_TO_BE_DELETED = 52
-# look through each one of them, and print numItems
-  for ml in myLists:
-      num = ml["numItems"]
-      # look at their numItems
-      if num == NUMITEMS_IN_LIST_TO_BE_DELETED:
-          print ml["numItems"], ml["id"]
-          client.delete_list(ml["id"])
+  filters = {"min_items": NUMITEMS_IN_LIST_TO_BE_DELETED,
+             "max_items": NUMITEMS_IN_LIST_TO_BE_DELETED}
+  dry_run = dict(filters, dry_run=1)
+  print "Lists to be deleted:", client.delete_lists(dry_run)["count"]
+
+# step 2 delete all of them in one call
+  print client.delete_lists(filters)
 
 
 # if numItems is zero, delete the empty list
@@ -12,7 +12,7 @@ Adapted from Adam's version by Ram Narasimhan
 import gflags
 import oauth2
 import time
-import httplib
+from connection_pool import get_pool
 import sys
 import csv
 import cfg
@@ -38,19 +38,20 @@ gflags.DEFINE_string('om_access_token', '', 'OpenMindsAPI access token. Used by
 class AbstractOpenMindsClient(object):
   '''
   Abstract OpenMindsClient class. Subclasses should implement the _api_response()
-  method, which should return the response from an HTTPConnection object.
+  method, which should return a response object with a read() method.
   '''
 
-  def __init__(self, host=None):
+  def __init__(self, host=None, pool_size=None):
     if host:
       self.host = host
     else:
       self.host = DEFAULT_HOST
+    self.pool = get_pool(self.host, pool_size)
     
   def _api_response(self, method, path, body={}):
     '''
     Implemented by subclasses. Should return a response
-    from an HTTPConnection object.
+    from the client's connection pool.
     '''
     return None
 
@@ -133,8 +134,8 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
   user provides an API key and API secret, which are used to securely sign the
   request.
   '''
-  def __init__(self, key, secret, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, key, secret, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.key = key
     self.secret = secret
 
@@ -164,13 +165,10 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
     req = self._get_request(method, path, str_body, extra_params=params)
     data = req.to_postdata()
 
-    connection = httplib.HTTPConnection(self.host)
     if self.host.startswith('localhost') and method == 'POST':
       # Workaround for sending api POST requests to local server.
-      connection.request(method, path, data)
-    else:
-      connection.request(method, path + '?' + data, str_body)
-    return connection.getresponse()
+      return self.pool.request(method, path, data)
+    return self.pool.request(method, path + '?' + data, str_body)
 
   def get_game_url(self, game_id, list_id, params):
     path = '/game/%s/%s/' % (game_id, list_id)
@@ -185,15 +183,14 @@ class OpenMindsThreeLeggedClient(AbstractOpenMindsClient):
   an app access through the web interface. The access token is used by the app
   to get access to the API on behalf of the user.
   '''
-  def __init__(self, access_token, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, access_token, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.access_token = access_token
 
   def _api_response(self, method, path, body=None):
     '''
     Includes the access token as a header in the request.
     '''
-    connection = httplib.HTTPConnection(self.host)
     if body:
       data = encode_json(body)
     else:
@@ -204,10 +201,8 @@ class OpenMindsThreeLeggedClient(AbstractOpenMindsClient):
     if method == 'GET':
       if data:
         path += '?' + data
-      connection.request(method, path, None, headers)
-    else:
-      connection.request(method, path, data, headers)
-    return connection.getresponse()
+      return self.pool.request(method, path, None, headers)
+    return self.pool.request(method, path, data, headers)
 
 
 
@@ -228,9 +223,9 @@ if __name__ == '__main__':
   # this enables the use of log() instead of print for debugging purposes
 
   if FLAGS.om_access_token:
-    client = OpenMindsThreeLeggedClient(FLAGS.om_access_token, FLAGS.om_host)
+    client = OpenMindsThreeLeggedClient(FLAGS.om_access_token, FLAGS.om_host, FLAGS.om_pool_size)
   else:
-    client = OpenMindsTwoLeggedClient(FLAGS.om_key, FLAGS.om_secret, FLAGS.om_host)
+    client = OpenMindsTwoLeggedClient(FLAGS.om_key, FLAGS.om_secret, FLAGS.om_host, FLAGS.om_pool_size)
 
 #  print client.get_user('me')
 #  print client.get_users()
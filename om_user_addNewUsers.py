@@ -12,7 +12,7 @@ Adapted from Adam's version by Ram Narasimhan
 import gflags
 import oauth2
 import time
-import httplib
+from connection_pool import get_pool
 import sys
 import csv
 from libraries.python.web_util import encode_json, decode_json
@@ -20,6 +20,9 @@ import om_utils
 
 DEFAULT_HOST = 'openminds.io'
 
+# Number of users sent in each create_users request.
+USERS_PER_REQUEST = 200
+
 FLAGS = gflags.FLAGS
 gflags.DEFINE_string('om_host', DEFAULT_HOST, 'OpenMinds Host')
 
@@ -32,19 +35,20 @@ gflags.DEFINE_string('om_access_token', '', 'OpenMindsAPI access token. Used by
 class AbstractOpenMindsClient(object):
   '''
   Abstract OpenMindsClient class. Subclasses should implement the _api_response()
-  method, which should return the response from an HTTPConnection object.
+  method, which should return a response object with a read() method.
   '''
 
-  def __init__(self, host=None):
+  def __init__(self, host=None, pool_size=None):
     if host:
       self.host = host
     else:
       self.host = DEFAULT_HOST
+    self.pool = get_pool(self.host, pool_size)
     
   def _api_response(self, method, path, body={}):
     '''
     Implemented by subclasses. Should return a response
-    from an HTTPConnection object.
+    from the client's connection pool.
     '''
     return None
 
@@ -64,6 +68,9 @@ class AbstractOpenMindsClient(object):
   def create_user(self, info):
     return self._get_json('POST', '/api/data/users/', info)
 
+  def create_users(self, infos):
+    return self._get_json('POST', '/api/data/users/', infos)
+
   def get_class(self, class_id):
     return self._get_json('GET', '/api/data/classes/%s/' % class_id)
 
@@ -127,8 +134,8 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
   user provides an API key and API secret, which are used to securely sign the
   request.
   '''
-  def __init__(self, key, secret, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, key, secret, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.key = key
     self.secret = secret
 
@@ -158,13 +165,10 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
     req = self._get_request(method, path, str_body, extra_params=params)
     data = req.to_postdata()
 
-    connection = httplib.HTTPConnection(self.host)
     if self.host.startswith('localhost') and method == 'POST':
       # Workaround for sending api POST requests to local server.
-      connection.request(method, path, data)
-    else:
-      connection.request(method, path + '?' + data, str_body)
-    return connection.getresponse()
+      return self.pool.request(method, path, data)
+    return self.pool.request(method, path + '?' + data, str_body)
 
   def get_game_url(self, game_id, list_id, params):
     path = '/game/%s/%s/' % (game_id, list_id)
@@ -179,15 +183,14 @@ class OpenMindsThreeLeggedClient(AbstractOpenMindsClient):
   an app access through the web interface. The access token is used by the app
   to get access to the API on behalf of the user.
   '''
-  def __init__(self, access_token, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, access_token, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.access_token = access_token
 
   def _api_response(self, method, path, body=None):
     '''
     Includes the access token as a header in the request.
     '''
-    connection = httplib.HTTPConnection(self.host)
     if body:
       data = encode_json(body)
     else:
@@ -198,10 +201,8 @@ class OpenMindsThreeLeggedClient(AbstractOpenMindsClient):
     if method == 'GET':
       if data:
         path += '?' + data
-      connection.request(method, path, None, headers)
-    else:
-      connection.request(method, path, data, headers)
-    return connection.getresponse()
+      return self.pool.request(method, path, None, headers)
+    return self.pool.request(method, path, data, headers)
 
 
 
@@ -251,9 +252,9 @@ if __name__ == '__main__':
 
 #  print FLAGS.om_host
   if FLAGS.om_access_token:
-    client = OpenMindsThreeLeggedClient(FLAGS.om_access_token, FLAGS.om_host)
+    client = OpenMindsThreeLeggedClient(FLAGS.om_access_token, FLAGS.om_host, FLAGS.om_pool_size)
   else:
-    client = OpenMindsTwoLeggedClient(FLAGS.om_key, FLAGS.om_secret, FLAGS.om_host)
+    client = OpenMindsTwoLeggedClient(FLAGS.om_key, FLAGS.om_secret, FLAGS.om_host, FLAGS.om_pool_size)
 
 #  print client.get_user('me')
   
@@ -271,17 +272,24 @@ if __name__ == '__main__':
   udictsList = create_item_dicts(textusers)
 
 
-  # create new items
-  for newuser in udictsList:
-    print "Will create:", newuser
-    nu = client.create_user(newuser)
-    
-    print nu
-    if "success" in nu:
-      print "user Creation failed", newuser
-      fails.append(newuser)
-      print
-      print
+  # create new users, USERS_PER_REQUEST at a time
+  for start in range(0, len(udictsList), USERS_PER_REQUEST):
+    batch = udictsList[start:start + USERS_PER_REQUEST]
+    print "Will create %d users" % len(batch)
+    results = client.create_users(batch)
+
+    # The whole batch failed: the server answers with one error object
+    # instead of a result per user.
+    if not isinstance(results, list) or len(results) != len(batch):
+      print "Batch creation failed", results
+      fails.extend(batch)
+      continue
+
+    for newuser, nu in zip(batch, results):
+      print nu
+      if "error" in nu:
+        print "user Creation failed", newuser
+        fails.append(newuser)
 
   print    
   print "Fails"
@@ -8,7 +8,7 @@ Adapted from Adam's version by Ram Narasimhan
 import logging
 import oauth2
 import time
-import httplib
+from connection_pool import get_pool
 import sys
 import csv
 from libraries.python.web_util import encode_json, decode_json
@@ -21,24 +21,28 @@ import cfg
 logging.basicConfig(format='%(asctime)s : %(levelname)s : %(message)s', level=logging.INFO)
 # http://antonym.org/2005/03/a-real-python-logging-example.html is very good
 
+# Number of users updated by each update_users request.
+UPDATES_PER_REQUEST = 200
+
 
 
 class AbstractOpenMindsClient(object):
   '''
   Abstract OpenMindsClient class. Subclasses should implement the _api_response()
-  method, which should return the response from an HTTPConnection object.
+  method, which should return a response object with a read() method.
   '''
 
-  def __init__(self, host=None):
+  def __init__(self, host=None, pool_size=None):
     if host:
       self.host = host
     else:
       self.host = DEFAULT_HOST
+    self.pool = get_pool(self.host, pool_size)
     
   def _api_response(self, method, path, body={}):
     '''
     Implemented by subclasses. Should return a response
-    from an HTTPConnection object.
+    from the client's connection pool.
     '''
     return None
 
@@ -49,6 +53,9 @@ class AbstractOpenMindsClient(object):
   def get_users(self):
     return self._get_json('GET', '/api/data/users/')
 
+  def update_users(self, updates):
+    return self._get_json('PUT', '/api/data/users/', updates)
+
   def get_user(self, user_id):
     return self._get_json('GET', '/api/data/users/%s/' % user_id)
 
@@ -127,8 +134,8 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
   user provides an API key and API secret, which are used to securely sign the
   request.
   '''
-  def __init__(self, key, secret, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, key, secret, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.key = key
     self.secret = secret
 
@@ -158,13 +165,10 @@ class OpenMindsTwoLeggedClient(AbstractOpenMindsClient):
     req = self._get_request(method, path, str_body, extra_params=params)
     data = req.to_postdata()
 
-    connection = httplib.HTTPConnection(self.host)
     if self.host.startswith('localhost') and method == 'POST':
       # Workaround for sending api POST requests to local server.
-      connection.request(method, path, data)
-    else:
-      connection.request(method, path + '?' + data, str_body)
-    return connection.getresponse()
+      return self.pool.request(method, path, data)
+    return self.pool.request(method, path + '?' + data, str_body)
 
   def get_game_url(self, game_id, list_id, params):
     path = '/game/%s/%s/' % (game_id, list_id)
@@ -179,15 +183,14 @@ class OpenMindsThreeLeggedClient(AbstractOpenMindsClient):
   an app access through the web interface. The access token is used by the app
   to get access to the API on behalf of the user.
   '''
-  def __init__(self, access_token, host=None):
-    AbstractOpenMindsClient.__init__(self, host)
+  def __init__(self, access_token, host=None, pool_size=None):
+    AbstractOpenMindsClient.__init__(self, host, pool_size)
     self.access_token = access_token
 
   def _api_response(self, method, path, body=None):
     '''
     Includes the access token as a header in the request.
     '''
-    connection = httplib.HTTPConnection(self.host)
     if body:
       data = encode_json(body)
     else:
@@ -198,10 +201,8 @@ class OpenMindsThreeLeggedClient(AbstractOpenMindsClient):
     if method == 'GET':
       if data:
         path += '?' + data
-      connection.request(method, path, None, headers)
-    else:
-      connection.request(method, path, data, headers)
-    return connection.getresponse()
+      return self.pool.request(method, path, None, headers)
+    return self.pool.request(method, path, data, headers)
 
 
 
@@ -212,9 +213,9 @@ if __name__ == '__main__':
   argv = cfg.FLAGS(sys.argv)
   print argv
   if cfg.FLAGS.om_access_token:
-    client = OpenMindsThreeLeggedClient(cfg.FLAGS.om_access_token, cfg.FLAGS.om_host)
+    client = OpenMindsThreeLeggedClient(cfg.FLAGS.om_access_token, cfg.FLAGS.om_host, cfg.FLAGS.om_pool_size)
   else:
-    client = OpenMindsTwoLeggedClient(cfg.FLAGS.om_key, cfg.FLAGS.om_secret, cfg.FLAGS.om_host)
+    client = OpenMindsTwoLeggedClient(cfg.FLAGS.om_key, cfg.FLAGS.om_secret, cfg.FLAGS.om_host, cfg.FLAGS.om_pool_size)
   
   # logging.info("Me: %s" % client.get_user('me'))
 
@@ -232,34 +233,45 @@ if __name__ == '__main__':
   print "Updating properties for users: \n"
   printList(userListToBeUpdated)
 
-  # step 2 For each valid user, get user_id
-  existingUsersList =  client.get_users()
-
-  for u in existingUsersList:
-      try:
-          print u["email"]
-      except:
-          pass
-
-
-  numusers = 0
+  # step 2 Send the property updates, keyed by username. The server looks
+  # the usernames up itself, so we no longer download every user first.
+  updates = {}
   for user in userListToBeUpdated:
-      numusers+= 1
+      if "username" not in user:
+          continue
       username = user["username"]
-      infoToUpdateJSON = user["JSON"]
-
-      userid = get_userid_given_username(existingUsersList,username)  #in om_utils.py      
-
-      # Step 3 update the property 
-      if isValidUser(userid):
-          client.update_user(userid,infoToUpdateJSON)     
-          logging.info("Username %s updated." % username)
-          print infoToUpdateJSON
-          
+      if username in updates:
+          # The rows used to be sent one PUT each, in file order, so merge
+          # them the same way: later rows win field by field.
+          logging.warning("Username %s appears more than once in %s, merging its rows: %s" % (username, filename, user["JSON"]))
+          updates[username].update(user["JSON"])
       else:
-          logging.warning("Username %s not found. Couldn't be updated." % username)
-
+          updates[username] = dict(user["JSON"])
+  usernames = updates.keys()
 
+  numusers = 0
+  for start in range(0, len(usernames), UPDATES_PER_REQUEST):
+      batch = dict((u, updates[u]) for u in usernames[start:start + UPDATES_PER_REQUEST])
+      results = client.update_users(batch)
+
+      # The whole batch failed: the server answers with one error object,
+      # whose "error" is a message rather than a per-user result.
+      if not isinstance(results, dict) or not isinstance(results.get("error", {}), dict):
+          for username in batch:
+              logging.warning("Username %s couldn't be updated: %s" % (username, results))
+          continue
+
+      # Step 3 report what happened to each user
+      for username in batch:
+          numusers+= 1
+          result = results.get(username)
+          if result is None:
+              logging.warning("Username %s couldn't be updated: no result from the server" % username)
+          elif "error" in result:
+              logging.warning("Username %s couldn't be updated: %s" % (username, result["error"]))
+          else:
+              logging.info("Username %s updated." % username)
+              print batch[username]
 
   logging.info("Done with all user updates %d" % numusers)
 
@@ -442,7 +442,103 @@ def  create_item_dicts(textlist,f_type,two_lines=False):
   return dictslist # a list of idicts
 
 
+def upload_items(client, list_id, idictsList, chunk_size=None):
+  '''
+  Create all the items of a list, chunk_size items per request, through
+  the array form of POST /lists/<id>/. The chunks are sent one after the
+  other and the server appends the items of each chunk in order, so the
+  list keeps the order of idictsList.
+  Returns one result per item, in the same order as idictsList:
+  {"info": <item dict>, "id": <new item id or None>, "error": <None or message>}
+  '''
+  if chunk_size is None:
+    chunk_size = FLAGS.upload_chunk_size
+
+  results = []
+  for start in range(0, len(idictsList), chunk_size):
+    chunk = idictsList[start:start + chunk_size]
+    try:
+      response = client.create_items(list_id, chunk)
+    except Exception, e:
+      logging.error("Upload of items %d to %d failed: %s" %
+                    (start, start + len(chunk) - 1, e))
+      response = {"error": str(e)}
+    results.extend(get_item_results(chunk, response))
+
+  num_created = len([r for r in results if r["id"]])
+  logging.info("Uploaded %d of %d items to list %s" %
+               (num_created, len(idictsList), list_id))
+  return results
+
+
+def create_list_with_items(client, ld, idictsList):
+  '''
+  Create a list and its items with one POST /lists/ request that embeds the
+  items. Returns the new list, or its error, and one upload_items result
+  per item, in the same order as idictsList.
+  If the server rejects the request, the list is created on its own. If
+  that succeeds, the embedded items were what the server rejected, as
+  servers without support for them do, and the items are added with
+  upload_items. Otherwise nothing has been created and every item gets
+  the error.
+  '''
+  data = dict(ld)
+  data["items"] = idictsList
+  newList = client.create_list(data)
+  if isResponseErrorFree(newList) == 1:
+    return newList, get_embedded_item_results(idictsList, newList)
 
+  newList = client.create_list(ld)
+  if isResponseErrorFree(newList) != 1:
+    return newList, [{"info": iteminfo, "id": None, "error": newList.get("error")}
+                     for iteminfo in idictsList]
 
+  logging.info("Server did not take the embedded items, uploading them to list %s" % newList["id"])
+  return newList, upload_items(client, newList["id"], idictsList)
 
 
+def get_embedded_item_results(idictsList, newList):
+  '''
+  One upload_items result per item, from the response to a list created
+  with embedded items: the items that were created appear in the new list
+  in order, and the others are listed in "itemErrors" by index.
+  '''
+  errors = dict((e["index"], e["error"]) for e in newList.get("itemErrors", []))
+  created = iter(newList.get("items", []))
+  results = []
+  for index, iteminfo in enumerate(idictsList):
+    result = {"info": iteminfo, "id": None, "error": errors.get(index)}
+    if result["error"] is None:
+      it = next(created, None)
+      if isinstance(it, dict) and "id" in it:
+        result["id"] = it["id"]
+      else:
+        result["error"] = "No item id in response"
+    results.append(result)
+  return results
+
+
+def get_item_results(chunk, response):
+  '''
+  One upload_items result per item of chunk, from the response to a
+  create_items request. A response that is not a list of one entry per
+  item means the whole request failed, so every item gets its error.
+  '''
+  if not isinstance(response, list) or len(response) != len(chunk):
+    if isinstance(response, dict) and response.get("error"):
+      error = response["error"]
+    else:
+      error = "Unexpected response: %s" % (response,)
+    return [{"info": iteminfo, "id": None, "error": error} for iteminfo in chunk]
+
+  results = []
+  for iteminfo, it in zip(chunk, response):
+    result = {"info": iteminfo, "id": None, "error": None}
+    if isinstance(it, dict) and "id" in it:
+      result["id"] = it["id"]
+    elif isinstance(it, dict) and it.get("error"):
+      result["error"] = it["error"]
+    else:
+      result["error"] = "No item id in response: %s" % (it,)
+    results.append(result)
+  return results
@@ -1,12 +1,14 @@
+# metrics has to be imported before backend opens the Mongo connection.
+from metrics import encode_json, instrument
 from auth import public_api_auth
 from bson.objectid import ObjectId
 from backend import Assignment, Class, User, List, Item, Event
 from libraries.python.cors_util import add_cors_headers
-from libraries.python.web_util import encode_json
 from libraries.python.web_util import parse_int_param, parse_int_param_as_bool
 from libraries.python.util import error_response
 from api_util import OpenMindsAPIHandler
 import adaptive_model
+from indexes import Index, QueryShape
 import json
 import logging
 import oauth
@@ -34,6 +36,33 @@ DEFAULT_SORT_DIR = 'desc'
 FILTER_OPTIONS = set(['all', 'mastered', 'unmastered', 'struggling'])
 DEFAULT_FILTER = 'all'
 
+# Indexes the handlers below rely on, in addition to those of data_api; see
+# indexes.py.
+INDEXES = [
+  Index(adaptive_model.UserStandardInfo, [('userId', pymongo.ASCENDING)]),
+  Index(adaptive_model.SamplingSummary,
+        [('userId', pymongo.ASCENDING), ('listId', pymongo.ASCENDING),
+         ('appId', pymongo.ASCENDING), ('timestamp', pymongo.DESCENDING)]),
+]
+
+# Representative queries of the handlers below, for indexes.py --check.
+QUERY_SHAPES = [
+  QueryShape('standards stats', adaptive_model.UserStandardInfo,
+             {'userId': ObjectId()}, [('standard', pymongo.DESCENDING)]),
+  QueryShape('lists for stats', List,
+             {'deleted': False, 'grade': 3, 'standard': 'RL', 'section': 1}),
+  QueryShape('lists stats', adaptive_model.UserListInfo,
+             {'userId': ObjectId(), 'listId': {'$in': [ObjectId()]}},
+             [('listId', pymongo.DESCENDING)]),
+  QueryShape('items stats', adaptive_model.UserItemInfo,
+             {'userId': ObjectId(), 'itemId': {'$in': [ObjectId()]}},
+             [('itemId', pymongo.DESCENDING)]),
+  QueryShape('samplings', adaptive_model.SamplingSummary,
+             {'userId': ObjectId(), 'listId': ObjectId(), 'appId': ObjectId()},
+             [('timestamp', -1)]),
+  QueryShape('list by id', List, {'_id': ObjectId(), 'deleted': False}),
+]
+
 
 def parse_page_params(params):
   num_items = parse_int_param(params.num, DEFAULT_NUM)
@@ -221,6 +250,7 @@ def get_sampling_stats(auth_user, list_id, app_id, num_samples):
 
 
 class StandardsHandler(OpenMindsAPIHandler):
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, auth_user=None, auth_app_id=None):
@@ -235,6 +265,7 @@ class StandardsHandler(OpenMindsAPIHandler):
 
 
 class ListsHandler(OpenMindsAPIHandler):
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, auth_user=None, auth_app_id=None):
@@ -252,6 +283,7 @@ class ListsHandler(OpenMindsAPIHandler):
 
 
 class ListHandler(OpenMindsAPIHandler):
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, list_id, auth_user=None, auth_app_id=None):
@@ -283,6 +315,7 @@ class ListHandler(OpenMindsAPIHandler):
 
 
 class SamplingsHandler(OpenMindsAPIHandler):
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, raw_list_id, raw_app_id, auth_user=None, auth_app_id=None):
@@ -314,6 +347,7 @@ class SamplingsHandler(OpenMindsAPIHandler):
 
 
 class AssignmentHandler(OpenMindsAPIHandler):
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, assignment_id, auth_user=None, auth_app_id=None):
@@ -350,6 +384,7 @@ class AssignmentHandler(OpenMindsAPIHandler):
 
 
 class ClassesHandler(OpenMindsAPIHandler):
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, auth_user=None, auth_app_id=None):
@@ -358,6 +393,7 @@ class ClassesHandler(OpenMindsAPIHandler):
 
 
 class ClassHandler(OpenMindsAPIHandler):
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, class_id, auth_user=None, auth_app_id=None):
@@ -366,6 +402,7 @@ class ClassHandler(OpenMindsAPIHandler):
 
 
 class StudentHandler(OpenMindsAPIHandler):
+  @instrument
   @add_cors_headers
   @public_api_auth
   def GET(self, class_id, student_id, auth_user=None, auth_app_id=None):